@@ -22,6 +22,7 @@ from werkzeug.security import check_password_hash
 from api.schema import schema
 from api.util.flask_utils import nocache
 from storage.sql import StorageSqliteDB, Subscription, Item, User
+from collectors.exceptions import DuplicateFound
 from collectors.manual import build_item_from_url
 
 try:
@@ -67,7 +68,7 @@ def get_app(storage, production=True):
 
     app.debug = not production
     assert isinstance(storage, StorageSqliteDB)
-    db_session = storage.db
+    db_session = storage.db  # a scoped session: each request thread gets its own
 
     def get_latest_sw():
         latest_file = None
@@ -92,7 +93,11 @@ def get_app(storage, production=True):
             "graphql",
             schema=schema,
             graphiql=True,  # for having the GraphiQL interface
-            context={"session": db_session, "flask_session": flask.session},
+            context={
+                "session": db_session,
+                "flask_session": flask.session,
+                "fulltext": storage.has_fulltext,
+            },
         ),
     )
 
@@ -197,16 +202,18 @@ def get_app(storage, production=True):
         extra_raw = data.get("extra", "{}")
         try:
             extra_obj = json.loads(extra_raw) if isinstance(extra_raw, str) else extra_raw
-            extra_json = json.dumps(extra_obj)
         except Exception:
             return jsonify({"error": "invalid extra json"}), 400
+        if not isinstance(extra_obj, dict):
+            return jsonify({"error": "invalid extra json"}), 400
         title = data.get("title")
         url = data.get("url")
         if title:
             item.title = title
         if url:
             item.url = url
-        item.extra = extra_json
+        item.set_extra(extra_obj)
+        item.content_hash = None  # the content is not the collected one anymore
         db_session.commit()
         return jsonify({"ok": True, "id": item_id})
 
@@ -222,6 +229,8 @@ def get_app(storage, production=True):
             storage.upsert(item, update=True)
             global_id = to_global_id("ItemType", item["id"])
             return jsonify({"ok": True, "id": global_id})
+        except DuplicateFound as exc:
+            return jsonify({"error": str(exc)}), 409
         except Exception as exc:
             logger.exception("Failed to create item from url")
             return jsonify({"error": str(exc)}), 500
@@ -295,7 +304,7 @@ def get_app(storage, production=True):
 
     @app.teardown_appcontext
     def shutdown_session(exception=None):
-        db_session.close()
+        db_session.remove()
 
     return app
 
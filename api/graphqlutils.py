@@ -5,9 +5,11 @@ import sqlalchemy
 from graphene import NonNull, Argument, List
 from graphene_sqlalchemy import SQLAlchemyConnectionField
 from graphql import ResolveInfo
-from graphql.language.ast import Variable
+from graphql.language.ast import Variable, FragmentSpread, InlineFragment
 from sqlalchemy import inspect
 
+from storage.sql import FULLTEXT_COLUMNS, fulltext_filter
+
 logger = logging.getLogger(__name__)
 
 
@@ -117,9 +119,14 @@ class FTSFilterableConnectionField(FilterableConnectionField):
                 cls._fulltext_field_suffix
             ):  # when they ends in __like
                 field_name = attr_name[: -len(cls._fulltext_field_suffix)]
-                logger.debug(f"Filter field {field_name} like {value}")
-                column = getattr(model, field_name)
-                query = query.filter(column.like(f"%{value.value}%"))
+                search = get_arg_val(value, info)
+                if info.context.get("fulltext") and field_name in FULLTEXT_COLUMNS:
+                    logger.debug(f"Filter field {field_name} matching {search}")
+                    query = fulltext_filter(query, search, columns=[field_name])
+                else:
+                    logger.debug(f"Filter field {field_name} like {search}")
+                    column = getattr(model, field_name)
+                    query = query.filter(column.like(f"%{search}%"))
 
         return query
 
@@ -141,3 +148,23 @@ def get_arg_val(arg, info: ResolveInfo):
         return result.value
     else:
         return result
+
+
+def selected_node_fields(info: ResolveInfo):
+    """Return the names of the fields asked for the nodes of a connection"""
+    fields = set()
+
+    def collect(selection_set, path):
+        for selection in selection_set.selections:
+            if isinstance(selection, FragmentSpread):
+                fragment = info.fragments[selection.name.value]
+                collect(fragment.selection_set, path)
+            elif isinstance(selection, InlineFragment):
+                collect(selection.selection_set, path)
+            elif not path:
+                fields.add(selection.name.value)
+            elif selection.name.value == path[0] and selection.selection_set:
+                collect(selection.selection_set, path[1:])
+
+    collect(info.field_asts[0].selection_set, ["edges", "node"])
+    return fields
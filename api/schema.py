@@ -4,9 +4,14 @@ import graphene
 from graphene import relay, String
 from graphene_sqlalchemy import SQLAlchemyObjectType
 from sqlalchemy import or_
+from sqlalchemy.orm import load_only
 
-from api.graphqlutils import FTSFilterableConnectionField, get_arg_val
-from storage.sql import Item
+from api.graphqlutils import (
+    FTSFilterableConnectionField,
+    get_arg_val,
+    selected_node_fields,
+)
+from storage.sql import Item, fulltext_filter
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +20,8 @@ class ItemType(SQLAlchemyObjectType):
     class Meta:
         model = Item
         interfaces = (relay.Node,)
+        # internal columns, for the dedupe and the change detection
+        exclude_fields = ("normalized_url", "content_hash")
 
 
 class Query(graphene.ObjectType):
@@ -53,11 +60,23 @@ class Query(graphene.ObjectType):
                 re_arguments.append(argument)
         # info.field_asts[0].arguments = re_arguments
         query = Query.items.get_query(Item, info)
+        # load just the requested columns (skipping the extra json when we can)
+        columns = [
+            field
+            for field in selected_node_fields(info)
+            if field in Item.__table__.columns
+        ]
+        if columns:
+            query = query.options(load_only(*columns))
         if not is_admin:
             query = query.filter(Item.hidden.is_(False))
-        if q:
+        if q and info.context.get("fulltext"):
+            logger.debug(f"FTS search of {q}")
+            # the relevance replaces the requested sort
+            query = fulltext_filter(query.order_by(None), q)
+        elif q:
             fts_fields = ("title", "type", "url")
-            logger.debug("FTS with like in {fts_fields}")
+            logger.debug(f"FTS with like in {fts_fields}")
             query = query.filter(
                 or_(*[getattr(Item, field).like(f"%{q}%") for field in fts_fields])
             )
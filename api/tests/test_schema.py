@@ -0,0 +1,66 @@
+import datetime
+
+from api.schema import schema
+from storage import Storage
+
+NOW = datetime.datetime(2020, 1, 1)
+
+
+def search(db, query):
+    result = schema.execute(
+        query, context={"session": db.db, "fulltext": db.has_fulltext}
+    )
+    assert not result.errors, result.errors
+    return sorted(edge["node"]["title"] for edge in result.data["items"]["edges"])
+
+
+def test_search_with_like_filters(tmpdir):
+    db = Storage.get("sqlite", str(tmpdir.join("db.sqlite")))
+    db.upsert_many(
+        [
+            dict(id="1", type="RSS", url="http://a/1", timestamp=NOW, title="Python"),
+            dict(id="2", type="RSS", url="http://b/2", timestamp=NOW, title="Python"),
+            dict(id="3", type="RSS", url="http://a/3", timestamp=NOW, title="Rust"),
+        ]
+    )
+    # each of q and the *__like filters joins the full-text index
+    assert search(
+        db, '{ items(q: "python", url__like: "a") { edges { node { title } } } }'
+    ) == ["Python"]
+    assert search(
+        db,
+        '{ items(title__like: "py", url__like: "b") { edges { node { title } } } }',
+    ) == ["Python"]
+    db.close()
+
+
+def test_internal_fields_not_exposed():
+    fields = schema.get_type("ItemType").fields
+    assert "normalized_url" not in fields
+    assert "content_hash" not in fields
+    arguments = schema.get_query_type().fields["items"].args
+    assert "normalized_url" not in arguments
+
+
+def test_search_sorted_by_relevance(tmpdir):
+    db = Storage.get("sqlite", str(tmpdir.join("db.sqlite")))
+    db.upsert_many(
+        [
+            dict(
+                id="1",
+                type="RSS",
+                url="http://a/1",
+                timestamp=NOW + datetime.timedelta(days=1),
+                title="Python news and more news of the week",
+            ),
+            dict(id="2", type="RSS", url="http://a/2", timestamp=NOW, title="Python"),
+        ]
+    )
+    result = schema.execute(
+        '{ items(q: "python", sort: TIMESTAMP_DESC) { edges { node { title } } } }',
+        context={"session": db.db, "fulltext": db.has_fulltext},
+    )
+    assert not result.errors, result.errors
+    titles = [edge["node"]["title"] for edge in result.data["items"]["edges"]]
+    assert titles[0] == "Python"
+    db.close()
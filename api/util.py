@@ -14,7 +14,7 @@ def change_sizes(sizes, db):
             if current_size != size:
                 logger.info(f"Changing size of {item['title']}: {current_size}=>{size}")
                 item["size"] = size
-                db.upsert(item, update=True)
+                db.upsert(item, update=True, update_hash=False)
 
 
 if __name__ == "__main__":
@@ -1,2 +1,6 @@
 class DuplicateFound(Exception):
     pass
+
+
+class CollectorTimeout(Exception):
+    pass
@@ -2,10 +2,15 @@ import json
 import logging
 import os
 import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
 from oauth2client.tools import ClientRedirectServer, ClientRedirectHandler
 
+from collectors.exceptions import CollectorTimeout
+from collectors.httpclient import session
+from storage import DUPLICATE, INSERTED, UPDATED, UNCHANGED
+
 muted_loggers = (
     "googleapiclient.discovery",
     "oauth2client",
@@ -27,10 +32,20 @@ logger = logging.getLogger(__name__)
 
 class Collector:
     type = "Collectory Type not specified"
+    backfill_workers = 4  # how many pages the backfills fetch at once
 
     def __init__(self, refresh_duplicates, db=None):
         self.refresh_duplicates = refresh_duplicates
         self.db = db
+        self.sync_state = {}  # where the previous run stopped
+        self.new_sync_state = {}  # what this run saw, saved when it's done
+        self.stats = dict(added=0, unchanged=0, pages=0)
+        self.deadline = None  # time.monotonic() limit to stop paging
+
+    @property
+    def sync_key(self):
+        """The key of the collector sync state"""
+        return self.type
 
     def initial_parameters(self, **kwargs):
         """Given the DB return the initial parameters to be passed to the collector....
@@ -38,16 +53,80 @@ class Collector:
         :rtype: dict
         :type db: Storage
         """
-        return dict()
+        self.sync_state = self.db.get_sync_state(self.sync_key)
+        return dict(sync_state=self.sync_state)
 
     def run(self, **params):
         raise NotImplementedError("Collectors should define what to do on run method")
 
+    def fetch_pages(self, get_page, keys):
+        """Yield get_page(key) for each of the keys in order, fetching them
+        concurrently - the pages not requested yet are cancelled on close()"""
+        executor = ThreadPoolExecutor(
+            max_workers=self.backfill_workers, thread_name_prefix=self.type.lower()
+        )
+        try:
+            yield from executor.map(get_page, keys)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def save_items(self, items):
+        """Store a page of collected items (the newest first) with a single write
+
+        Return how many items got added (or updated) and if the collector
+        can stop: we stop paging as soon as we find an item we already know
+        or the cursor of the previous run
+        """
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise CollectorTimeout(f"{self.sync_key} took too long")
+        if not items:
+            return 0, False
+        # the first item is the newest one: the next run can stop there
+        self.new_sync_state.setdefault("cursor", items[0]["id"])
+        timestamps = [item["timestamp"] for item in items]
+        if "last_timestamp" in self.new_sync_state:
+            timestamps.append(self.new_sync_state["last_timestamp"])
+        self.new_sync_state["last_timestamp"] = max(timestamps)
+        self.stats["pages"] += 1
+
+        reached_cursor = False
+        cursor = self.sync_state.get("cursor")
+        if cursor and not self.refresh_duplicates:
+            ids = [item["id"] for item in items]
+            if cursor in ids:
+                items = items[: ids.index(cursor)]
+                reached_cursor = True
+        found_known = False
+        if not self.refresh_duplicates:
+            # we skip the known items with a single lookup, without writing them
+            known = self.db.known_ids(self.type, [item["id"] for item in items])
+            if known:
+                items = [item for item in items if item["id"] not in known]
+                found_known = True
+        if not items:
+            return 0, reached_cursor or found_known
+
+        statuses = self.db.upsert_many(items, update=self.refresh_duplicates)
+        count = 0
+        for item, status in zip(items, statuses):
+            if status == UNCHANGED:
+                self.stats["unchanged"] += 1
+            if status not in (INSERTED, UPDATED):
+                continue
+            logger.info(
+                "{type} - {title} ({id})".format(
+                    type=self.type, title=item["title"], id=item["id"]
+                )
+            )
+            count += 1
+        self.stats["added"] += count
+        return count, reached_cursor or found_known or DUPLICATE in statuses
+
 
 class OAuthCollector(Collector):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.session = requests.session()
+        self.session = session
 
     def get_api_secrets(self):
         api_secrets_file = self.get_api_secrets_filepath()
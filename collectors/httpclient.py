@@ -0,0 +1,56 @@
+"""The HTTP client shared by the collectors and the scrapers
+
+A single requests session with a pool of keep-alive connections per host:
+a collection run reuses them instead of connecting for every request.
+Requests (gzip included) have a default timeout and the connection errors,
+rate limits and server errors are retried with an exponential backoff.
+"""
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = "flatdario"
+TIMEOUT = (5, 30)  # seconds to connect and to read
+POOL_HOSTS = 20  # how many hosts have their connections kept alive
+POOL_CONNECTIONS_PER_HOST = 4  # more concurrent requests to a host wait
+
+
+class TimeoutSession(requests.Session):
+    """A session that never waits forever: requests have a default timeout"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+def new_session():
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False,  # after the retries, the caller checks the status
+    )
+    adapter = HTTPAdapter(
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=POOL_CONNECTIONS_PER_HOST,
+        pool_block=True,
+        max_retries=retry,
+    )
+    http_session = TimeoutSession()
+    http_session.headers["User-Agent"] = USER_AGENT
+    http_session.mount("https://", adapter)
+    http_session.mount("http://", adapter)
+    return http_session
+
+
+session = new_session()
+
+
+def new_httplib2():
+    """The HTTP client for the Google API library, that needs httplib2
+
+    It keeps its connections alive, but it's not thread safe:
+    use one for each thread.
+    """
+    return httplib2.Http(timeout=TIMEOUT[1])
@@ -1,18 +1,17 @@
 import datetime
+import itertools
 import json
 import logging
 import os
+from contextlib import closing
 
 import pytz
-import requests
 
-from collectors.exceptions import DuplicateFound
 from .generic import OAuthCollector
+from .httpclient import session
 
 logger = logging.getLogger(__name__)
 
-session = requests.session()
-
 
 def get_timestamp_from_epoch(epoch_string):
     epoch_time = int(epoch_string)
@@ -35,6 +34,9 @@ def get_epoch_from_timestamp(timestamp):
 
 class PocketCollector(OAuthCollector):
     type = "Pocket"
+    page_size = 30  # the most the API returns at once
+    incremental_page_size = 5  # the first page, when we expect few new items
+    with_media = True  # with False we ask the simple details, without images and videos
     api_secrets_file = os.path.join("appkeys", "pocket.json")
     user_secrets_file = os.path.join("userkeys", "pocket.json")
 
@@ -62,99 +64,122 @@ class PocketCollector(OAuthCollector):
         """If we are not refreshing we ask pocket only from the time of last element"""
         result = super(PocketCollector, self).initial_parameters(**kwargs)
         if not self.refresh_duplicates:
-            max_timestamp = self.db.max_timestamp(type=self.type)
+            max_timestamp = self.sync_state.get("last_timestamp")
+            if max_timestamp is None:  # no previous run, we look in the DB
+                max_timestamp = self.db.max_timestamp(type=self.type)
             result.update(dict(max_timestamp=max_timestamp))
         return result
 
+    def retrieve(self, query, offset, count, **options):
+        """Get a page of the Pocket list"""
+        response = session.post(
+            self.get_endpoints()["retrieve"],
+            headers={"X-Accept": "application/json"},
+            data=dict(query, offset=offset, count=count, **options),
+        )
+        if response.status_code != 200:
+            raise Exception("Error getting list of items from Pocket")
+        return response.json()
+
+    def items_from_page(self, data):
+        items = []
+        # data["list"] is an empty list when there are no results
+        for item_id, e in (data["list"] or {}).items():
+            # there are other times eventually:
+            #  "time_added", "time_updated", "time_read", "time_favorited"
+            # get the images & video sources, preserving the order
+            images = [
+                e["images"][imgid]["src"]
+                for imgid in sorted(list(e.get("images", {}).keys()))
+            ]
+            videos = [
+                e["videos"][imgid]["src"]
+                for imgid in sorted(list(e.get("videos", {}).keys()))
+            ]
+            title = e["resolved_title"]
+            item = dict(
+                id=item_id,
+                type=self.type,
+                url=e["resolved_url"],
+                timestamp=parse_datetime(get_timestamp_from_epoch(e["time_updated"])),
+                timestamp_added=parse_datetime(
+                    get_timestamp_from_epoch(e["time_added"])
+                ),
+                title=title,
+                tags=list(e.get("tags", {}).keys()),
+                images=images,
+                videos=videos,
+                excerpt=e["excerpt"],
+            )
+            items.append(item)
+        return items
+
     def run(self, **params):
-        refresh_duplicates = self.refresh_duplicates
         # tried to use the Google OAuth implementation, but:
         # * Pocket does not support GET requests
         # * The Flow is quite not standard
         last_timestamp = params.get("max_timestamp")
 
-        chunk_size = 5
         credentials = self.authenticate()
-        endpoints = self.get_endpoints()
 
         query = dict(
             consumer_key=credentials["consumer_key"],
             access_token=credentials["authentication_token"],
             state="archive",
             sort="newest",
-            detailType="complete",
-            count=chunk_size,
+            detailType="complete" if self.with_media else "simple",
         )
         if last_timestamp:
             query["since"] = get_epoch_from_timestamp(last_timestamp)
+            count, processed = self.run_incremental(query)
+        else:
+            count, processed = self.run_backfill(query)
+        logger.debug("Runner finished, after %d added, %d updated" % (count, processed))
 
-        start_from = 0
-        count = 0
-        processed = 0
-
+    def run_incremental(self, query):
+        """Get the few new items: the pages grow while they are all new"""
+        offset = 0
+        page_size = self.incremental_page_size
+        count = processed = 0
         while True:
-            query["offset"] = start_from
-            # logger.debug("Asking chunk %d-%d" % (start_from, start_from + chunk_size))
-            response = session.post(
-                endpoints["retrieve"],
-                headers={"X-Accept": "application/json"},
-                data=query,
-            )
-            if response.status_code != 200:
-                raise Exception("Error getting list of items from Pocket")
-            data = response.json()
-            returned_elements = len(data["list"])
-            # logger.debug("Pocket query returned %d elements" % returned_elements)
-            if data["list"]:
-                for item_id, e in data["list"].items():
-                    # there are other times eventually:
-                    #  "time_added", "time_updated", "time_read", "time_favorited"
-                    # get the images & video sources, preserving the order
-                    images = [
-                        e["images"][imgid]["src"]
-                        for imgid in sorted(list(e.get("images", {}).keys()))
-                    ]
-                    videos = [
-                        e["videos"][imgid]["src"]
-                        for imgid in sorted(list(e.get("videos", {}).keys()))
-                    ]
-                    title = e["resolved_title"]
-                    item = dict(
-                        id=item_id,
-                        type=self.type,
-                        url=e["resolved_url"],
-                        timestamp=parse_datetime(
-                            get_timestamp_from_epoch(e["time_updated"])
-                        ),
-                        timestamp_added=parse_datetime(
-                            get_timestamp_from_epoch(e["time_added"])
-                        ),
-                        title=title,
-                        tags=list(e.get("tags", {}).keys()),
-                        images=images,
-                        videos=videos,
-                        excerpt=e["excerpt"],
-                    )
-                    try:
-                        processed += 1
-                        self.db.upsert(item, update=refresh_duplicates)
-                        logger.info(
-                            "{type} - {title} ({id})".format(
-                                type=self.type, title=title, id=item_id
-                            )
-                        )
-                        count += 1
-                    except DuplicateFound:
-                        if not refresh_duplicates:
-                            logger.debug(
-                                "We already know this one. Stopping after %d added."
-                                % count
-                            )
-                            return
-            if returned_elements < chunk_size:
+            data = self.retrieve(query, offset, page_size)
+            items = self.items_from_page(data)
+            added, known = self.save_items(items)
+            count += added
+            processed += len(items)
+            if known:
+                logger.debug(
+                    "We already know this one. Stopping after %d added." % count
+                )
                 break
-            start_from += chunk_size
-        logger.debug("Runner finished, after %d added, %d updated" % (count, processed))
+            if len(items) < page_size:
+                break
+            offset += page_size
+            page_size = min(page_size * 2, self.page_size)
+        return count, processed
+
+    def run_backfill(self, query):
+        """Get the whole list: the pages after the first are fetched concurrently
+        and saved in order"""
+        first_page = self.retrieve(query, 0, self.page_size, total=1)
+        total = int(first_page.get("total") or 0)
+        offsets = range(self.page_size, total, self.page_size)
+        count = processed = 0
+        next_pages = self.fetch_pages(
+            lambda offset: self.retrieve(query, offset, self.page_size), offsets
+        )
+        with closing(next_pages):
+            for data in itertools.chain([first_page], next_pages):
+                items = self.items_from_page(data)
+                added, known = self.save_items(items)
+                count += added
+                processed += len(items)
+                if known:
+                    logger.debug(
+                        "We already know this one. Stopping after %d added." % count
+                    )
+                    break
+        return count, processed
 
 
 def parse_datetime(timestamp):
@@ -4,8 +4,8 @@ from time import mktime
 
 import feedparser
 
-from collectors.exceptions import DuplicateFound
 from collectors.generic import Collector
+from collectors.httpclient import session
 
 logger = logging.getLogger(__name__)
 
@@ -27,11 +27,33 @@ class RSSCollector(Collector):
         self.url = url
         super().__init__(*args, **kwargs)
 
+    @property
+    def sync_key(self):
+        return f"{self.type}:{self.url}"
+
     def run(self, **params):
         logger.debug("Running RSS: %s" % self.url)
 
-        doc = feedparser.parse(self.url)
-        count = 0
+        sync_state = params.get("sync_state") or {}
+        headers = {}
+        if not self.refresh_duplicates:
+            # the feed is downloaded and parsed only when it changed
+            if sync_state.get("etag"):
+                headers["If-None-Match"] = sync_state["etag"]
+            if sync_state.get("modified"):
+                headers["If-Modified-Since"] = sync_state["modified"]
+        response = session.get(self.url, headers=headers)
+        if response.status_code == 304:
+            logger.debug("RSS not modified: %s" % self.url)
+            return
+        response.raise_for_status()
+        doc = feedparser.parse(response.content, response_headers=response.headers)
+        self.new_sync_state.update(
+            etag=response.headers.get("ETag"),
+            modified=response.headers.get("Last-Modified"),
+        )
+
+        items = []
         for entry in doc.entries:
             entry_date = datetime.datetime.fromtimestamp(
                 mktime(entry.get("published_parsed", entry["updated_parsed"]))
@@ -50,19 +72,8 @@ class RSSCollector(Collector):
                 content=content,
                 tags=tags,
             )
-            try:
-                self.db.upsert(item, update=self.refresh_duplicates)
-                logger.info(
-                    "{type} - {title} ({id})".format(
-                        type=self.type, title=title, id=url
-                    )
-                )
-                count += 1
-            except DuplicateFound:
-                if not self.refresh_duplicates:
-                    logger.debug(
-                        "We already know this one. Stopping after %d added." % count
-                    )
-                    return
+            items.append(item)
 
+        # the whole feed is a single page
+        count, _ = self.save_items(items)
         logger.debug("Runner finished, after %d added" % count)
@@ -0,0 +1,125 @@
+"""A persistent cache of what the scrapers got from each url
+
+The results are kept in a SQLite file by url and kind (title, opengraph,
+largest_image...): for a week when we found something, for a day when we
+didn't (negative caching), so failing pages are not tried on every run.
+The oldest entries are evicted when the cache grows over max_entries.
+"""
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MISS = object()  # what get returns when the url is not in the cache
+
+# the API runs from its folder: the cache stays in the project one
+PROJECT_PATH = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+
+
+class ScrapeCache:
+    def __init__(
+        self,
+        filename=os.path.join(PROJECT_PATH, "cache", "scrape.sqlite"),
+        ttl=7 * 24 * 60 * 60,
+        negative_ttl=24 * 60 * 60,
+        max_entries=20000,
+    ):
+        self.filename = filename
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = None
+        self._writes = 0
+
+    def _connect(self):
+        if self._connection is None:
+            folder = os.path.dirname(self.filename)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            # the scrapers run in many threads, we serialize them with the lock
+            self._connection = sqlite3.connect(
+                self.filename, check_same_thread=False, isolation_level=None
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS scrape_cache ("
+                " url TEXT NOT NULL, kind TEXT NOT NULL, value TEXT,"
+                " status INTEGER, fetched_at REAL NOT NULL, expires_at REAL NOT NULL,"
+                " PRIMARY KEY (url, kind))"
+            )
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_scrape_cache_fetched_at"
+                " ON scrape_cache (fetched_at)"
+            )
+        return self._connection
+
+    def get(self, url, kind):
+        """Return the cached value, MISS when it's not there or it expired"""
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT value FROM scrape_cache"
+                    " WHERE url = ? AND kind = ? AND expires_at > ?",
+                    (url, kind, time.time()),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return MISS
+        return json.loads(row[0])
+
+    def set(self, url, kind, value, status=None):
+        """Cache a value, None when we didn't find anything
+        - status is the HTTP status of the page, when we know it"""
+        now = time.time()
+        ttl = self.negative_ttl if value is None else self.ttl
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO scrape_cache"
+                " (url, kind, value, status, fetched_at, expires_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (url, kind, json.dumps(value), status, now, now + ttl),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        connection.execute("DELETE FROM scrape_cache WHERE expires_at <= ?", (now,))
+        (count,) = connection.execute("SELECT COUNT(*) FROM scrape_cache").fetchone()
+        if count > self.max_entries:
+            logger.debug(f"Evicting {count - self.max_entries} scrape cache entries")
+            connection.execute(
+                "DELETE FROM scrape_cache WHERE rowid IN ("
+                " SELECT rowid FROM scrape_cache ORDER BY fetched_at LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def cached(self, kind):
+        """Decorate a function of an url, to cache its results as kind"""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(url):
+                value = self.get(url, kind)
+                if value is MISS:
+                    value = function(url)
+                    self.set(url, kind, value)
+                return value
+
+            return wrapper
+
+        return decorator
+
+
+scrape_cache = ScrapeCache()
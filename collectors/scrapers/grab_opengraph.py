@@ -1,9 +1,19 @@
 import logging
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 
-from collectors.scrapers.render_page import grab_largest_image
+from collectors.scrapers.render_page import browser_pool, grab_largest_image
+from collectors.scrapers.page_metadata import get_page_metadata
 
 logger = logging.getLogger(__name__)
 
+ENRICH_WORKERS = 4  # items enriched at once
+WRITE_BATCH_SIZE = 20  # the enriched items are saved in batches
+
 
 def get_thumbnail(item):
     itype = item["type"]
@@ -26,25 +36,20 @@ def get_thumbnail(item):
         pass
 
 
-def get_thumb_from_opengraph(item):
+def apply_opengraph(item, metadata):
+    """Take the title and the thumbnail of the item from the page metadata
+    - return if the item changed"""
     changed = False
-    url = item["url"]
-    logger.info(f"{item['type']} {item['title']} - parsing {url}")
-    try:
-        import opengraph
-
-        ogdata = opengraph.OpenGraph(url, scrape=True)
-    except:
-        ogdata = None
+    ogdata = metadata and (metadata["opengraph"] or metadata["twitter"])
     if ogdata:
         # we have the parsed data, let's also update the title
         ogtitle = f"{ogdata.get('site_name')}: " if ogdata.get("site_name") else ""
-        ogtitle += ogdata.get("title")
+        ogtitle += ogdata.get("title") or ""
         if ogtitle and ogtitle != item["title"]:
             logger.debug(f"Changed title {item['title']} => {ogtitle}")
             item["title"] = ogtitle.strip()
             changed = True
-        if ogdata["image"]:
+        if ogdata.get("image"):
             thumb = ogdata["image"]
             if not thumb.startswith("/"):  # ignore relative images
                 item["thumb"] = thumb  # do the change
@@ -52,42 +57,83 @@ def get_thumb_from_opengraph(item):
     return changed
 
 
-def fill_missing_infos(db, items=None):
-    logger.debug("Filling missing infos")
-    changes = 0
-    for item in items or db.all():
-        if item.get("thumb"):  # temp
-            continue
-        changed = False
-
-        if not item.get("thumb"):
-            # get from content
-            content_thumb = get_thumbnail(item)
-            if content_thumb:
-                item["thumb"] = content_thumb
-                changed = True
+def get_thumb_from_opengraph(item):
+    url = item["url"]
+    logger.info(f"{item['type']} {item['title']} - parsing {url}")
+    return apply_opengraph(item, get_page_metadata(url))
+
+
+def enrich_item(item):
+    """Look for the thumbnail of an item: in its content, in the page opengraph
+    and finally rendering the page - the thumb is empty when we find none"""
+    content_thumb = get_thumbnail(item)
+    if content_thumb:
+        item["thumb"] = content_thumb
+        return
+
+    # parse the site to get a thumbnail
+    get_thumb_from_opengraph(item)
+
+    if not item.get("thumb"):
+        # parse and grab the biggest image
+        thumb = grab_largest_image(item["url"])
+        if thumb:
+            logger.info(f"Using largest image: {thumb}")
+            item["thumb"] = thumb
+
+    if not item.get("thumb"):
+        item["thumb"] = ""  # stop searching for thumbs
+
+
+def bounded_map(function, items, workers):
+    """Yield (item, function(item)) as they complete, running them in a pool
+    of workers, with no more than 2 * workers items waiting at once"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="enrich") as pool:
+        pending = {}
+        for item in items:
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+            pending[pool.submit(function, item)] = item
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+
+
+def safe_enrich_item(item):
+    """Enrich the item, return if it changed"""
+    try:
+        enrich_item(item)
+    except Exception:
+        logger.exception(f"Cannot enrich {item['url']}")
+        return False
+    return True
 
-        if not item.get("thumb"):
-            # parse the site to get a thumbnail
-            changed = changed or get_thumb_from_opengraph(item)
 
-        if not item.get("thumb"):
-            # parse and grab the biggest image
-            thumb = grab_largest_image(item["url"])
-            if thumb:
-                logger.info(f"Using largest image: {thumb}")
-                item["thumb"] = thumb
-                changed = True
+def fill_missing_infos(db, items=None, workers=ENRICH_WORKERS):
+    """Enrich the items missing a thumbnail, concurrently
 
-        if not item.get("thumb"):
-            item["thumb"] = ""  # stop searching for thumbs
-            changed = True
+    The results are written in batches by the calling thread
+    """
+    logger.debug("Filling missing infos")
+    if items is None:
+        items = db.items_needing_enrichment()
+    else:
+        items = [item for item in items if item.get("thumb") is None]
 
+    changes = 0
+    changed_items = []
+    for item, changed in bounded_map(safe_enrich_item, items, workers):
         if changed:
-            db.upsert(item, update=True)
-            changes += 1
-            # stop searching for thumb
-
+            changed_items.append(item)
+        if len(changed_items) >= WRITE_BATCH_SIZE:
+            db.upsert_many(changed_items, update=True, update_hash=False)
+            changes += len(changed_items)
+            changed_items = []
+    if changed_items:
+        db.upsert_many(changed_items, update=True, update_hash=False)
+        changes += len(changed_items)
+    browser_pool.close()  # don't keep the browser running after the enrichment
     logger.info(f"Changes: {changes}")
 
 
@@ -0,0 +1,181 @@
+"""What we need from a page, with a single fetch and a single parse
+
+The title, the OpenGraph and Twitter card fields and the best image
+candidate come together from get_page_metadata, cached for all the scrapers.
+The page is streamed through an event parser that doesn't build a tree:
+the reading stops at the end of the <head>, unless we need the <img> of
+the body, and never goes over MAX_BYTES.
+"""
+import codecs
+import logging
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+
+from collectors.httpclient import session
+from collectors.scrapers.cache import MISS, scrape_cache
+
+logger = logging.getLogger(__name__)
+
+MAX_BYTES = 1024 * 1024  # we don't read more of a page
+CHUNK_SIZE = 16 * 1024
+CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+def fetch_page(url):
+    """Return the streamed page response, None when it fails
+
+    The failures are cached, the page is not requested again for a while
+    """
+    if scrape_cache.get(url, "failure") is not MISS:
+        return None
+    try:
+        response = session.get(url, timeout=10, stream=True)
+    except Exception as exc:
+        logger.warning("Failed to fetch %s: %s", url, exc)
+        scrape_cache.set(url, "failure", None)
+        return None
+    if response.status_code != 200:
+        response.close()
+        scrape_cache.set(url, "failure", None, status=response.status_code)
+        return None
+    return response
+
+
+class MetadataParser(HTMLParser):
+    """Collect the title, the meta and the img tags of a page fed in chunks"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title_parts = []
+        self.in_title = False
+        self.head_done = False
+        self.metas = []
+        self.imgs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self.head_done:
+            self.in_title = True
+        elif tag == "meta":
+            self.metas.append(dict(attrs))
+        elif tag == "img":
+            self.imgs.append(dict(attrs))
+        elif tag == "body":
+            self.head_done = True
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self.in_title = False
+        elif tag == "head":
+            self.head_done = True
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title_parts.append(data)
+
+    def meta_fields(self, prefix):
+        """The content of the meta with a property (or name) starting with prefix"""
+        fields = {}
+        for meta in self.metas:
+            key = meta.get("property") or meta.get("name") or ""
+            if key.startswith(prefix) and meta.get("content"):
+                fields.setdefault(key[len(prefix) :], meta["content"])
+        return fields
+
+    def head_image(self):
+        og_image = self.meta_fields("og:").get("image")
+        return og_image or self.meta_fields("twitter:").get("image")
+
+    def largest_img(self):
+        """The src of the img with the largest declared size, or the first one"""
+        best = None
+        best_area = 0
+        for img in self.imgs:
+            src = img.get("src")
+            if not src:
+                continue
+            try:
+                area = int(img.get("width") or 0) * int(img.get("height") or 0)
+            except ValueError:
+                area = 0
+            if area > best_area:
+                best_area = area
+                best = src
+
+        if not best:
+            best = next((img["src"] for img in self.imgs if img.get("src")), None)
+        return best
+
+    def metadata(self, url):
+        title = "".join(self.title_parts).strip()
+        image = self.head_image() or self.largest_img()
+        return dict(
+            title=title or None,
+            opengraph=self.meta_fields("og:"),
+            twitter=self.meta_fields("twitter:"),
+            image=urljoin(url, image) if image else None,
+        )
+
+
+def page_encoding(response, first_chunk):
+    """The charset of the headers, or of the meta tag, or utf8"""
+    if "charset" in response.headers.get("Content-Type", "").lower():
+        encoding = response.encoding
+    else:
+        match = CHARSET_RE.search(first_chunk)
+        encoding = match.group(1).decode("ascii") if match else "utf-8"
+    try:
+        codecs.lookup(encoding)
+    except LookupError:
+        encoding = "utf-8"
+    return encoding
+
+
+def read_metadata(response, url):
+    """Parse the streamed page, reading it only while we need it
+    - None when the page broke before we could read anything"""
+    parser = MetadataParser()
+    decoder = None
+    read = 0
+    with response:
+        try:
+            for chunk in response.iter_content(CHUNK_SIZE):
+                if decoder is None:
+                    decoder = codecs.getincrementaldecoder(
+                        page_encoding(response, chunk)
+                    )(errors="replace")
+                parser.feed(decoder.decode(chunk))
+                read += len(chunk)
+                if parser.head_done and parser.head_image():
+                    break  # we continue in the body just to look for the img
+                if read >= MAX_BYTES:
+                    logger.debug(f"Stop reading {url} after {read} bytes")
+                    break
+        except requests.RequestException as exc:
+            # the page stalled or broke: we keep what we parsed so far
+            logger.warning("Failed reading %s after %d bytes: %s", url, read, exc)
+            if not read:
+                scrape_cache.set(url, "failure", None)
+                return None
+    parser.close()
+    return parser.metadata(url)
+
+
+def parse_metadata(html, url):
+    """The metadata of a page we already have"""
+    parser = MetadataParser()
+    parser.feed(html)
+    parser.close()
+    return parser.metadata(url)
+
+
+@scrape_cache.cached("metadata")
+def get_page_metadata(url):
+    """Return the page title, opengraph and twitter dictionaries and the best
+    image - None when we cannot get the page"""
+    response = fetch_page(url)
+    if response is None:
+        return None
+    return read_metadata(response, url)
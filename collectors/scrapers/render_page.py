@@ -1,50 +1,168 @@
+import asyncio
+import atexit
 import logging
+import threading
+from urllib.parse import urlparse
+
+from collectors.scrapers.cache import MISS, scrape_cache
 
 logger = logging.getLogger(__name__)
 
+LARGEST_IMAGE_JS = """() => {
+    var images = document.getElementsByTagName('img')
+    var maxImg = null, maxArea=0, anchor;
+    for (var i=0, len=images.length; i<len; i++)  {
+        img = images[i];
+        var imgArea = img.naturalWidth * img.naturalHeight;
+        if (imgArea > maxArea) {
+            maxArea = imgArea;
+            maxImg = img.src
+        }
+    }
+    if (maxImg) {
+        anchor = document.createElement('a');
+        anchor.href = maxImg;
+        return anchor.href; // return the absolute path
+    }
+    return maxImg
+}"""
 
-def grab_largest_image(url):
-    import asyncio
-    from pyppeteer import launch
+# we need the images, not what the pages need to be read
+BLOCKED_RESOURCES = {"font", "media", "websocket", "eventsource"}
 
-    async def main():
-        browser = None
-        try:
-            browser = await launch()
-            page = await browser.newPage()
-            logger.info(f"Opening page {url}")
-
-            await page.goto(url, timeout=10000)
-
-            max_img = await page.evaluate("""() => {
-                        var images = document.getElementsByTagName('img')
-                        var maxImg = null, maxArea=0, anchor;
-                        for (var i=0, len=images.length; i<len; i++)  {
-                            img = images[i];
-                            var imgArea = img.naturalWidth * img.naturalHeight;
-                            if (imgArea > maxArea) {
-                                maxArea = imgArea;
-                                maxImg = img.src
-                            }
-                        }
-                        if (maxImg) {
-                            anchor = document.createElement('a');
-                            anchor.href = maxImg;
-                            return anchor.href; // return the absolute path
-                        }
-                        return maxImg
-                    }""")
+
+def site(url):
+    host = urlparse(url).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+class BrowserPool:
+    """A long-lived headless browser, rendering the pages in parallel tabs
+
+    The browser lives in an event loop running in its own thread, so it can
+    be used from any thread. The tabs are reused, at most max_pages at once.
+    """
+
+    def __init__(self, max_pages=4, timeout=10000):
+        self.max_pages = max_pages
+        self.timeout = timeout  # milliseconds to load a page
+        self._lock = threading.Lock()
+        self._loop = None
+        self._browser = None
+        self._idle_pages = []
+        self._page_sites = {}  # the site each page is rendering
+        self._semaphore = None
+        self._launch_lock = None
+
+    def _run(self, coroutine):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="browser-pool", daemon=True
+                ).start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _get_browser(self):
+        """The browser, launched once even when many pages wait for it"""
+        if self._launch_lock is None:
+            self._launch_lock = asyncio.Lock()
+        async with self._launch_lock:
+            if self._browser is None:
+                from pyppeteer import launch
+
+                # the signal handlers can be set only in the main thread
+                self._browser = await launch(
+                    handleSIGINT=False, handleSIGTERM=False, handleSIGHUP=False
+                )
+        return self._browser
+
+    async def _new_page(self):
+        browser = await self._get_browser()
+        page = await browser.newPage()
+        await page.setRequestInterception(True)
+        page.on(
+            "request",
+            lambda request: asyncio.ensure_future(self._filter(page, request)),
+        )
+        return page
+
+    async def _filter(self, page, request):
+        """Skip the fonts, the media and the scripts of the other sites"""
+        blocked = request.resourceType in BLOCKED_RESOURCES or (
+            request.resourceType == "script"
+            and site(request.url) != self._page_sites.get(page)
+        )
+        if blocked:
+            await request.abort()
+        else:
+            await request.continue_()
+
+    async def _grab(self, url):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_pages)
+        async with self._semaphore:
+            page = self._idle_pages.pop() if self._idle_pages else None
+            try:
+                if page is None:
+                    page = await self._new_page()
+                self._page_sites[page] = site(url)
+                logger.info(f"Opening page {url}")
+                await page.goto(url, timeout=self.timeout)
+                max_img = await page.evaluate(LARGEST_IMAGE_JS)
+            except Exception:
+                logger.error(f"Error rendering page {url}")
+                if page is not None:
+                    # a page in error is not reused
+                    self._page_sites.pop(page, None)
+                    await self._close_page(page)
+                return None
+            self._idle_pages.append(page)
             return max_img
-        except Exception as e:
-            logger.error(f"Error rendering page {url}")
+
+    @staticmethod
+    async def _close_page(page):
+        try:
+            await page.close()
+        except Exception:
             pass
-        finally:
-            if browser:
-                await browser.close()
-
-    try:
-        loop = asyncio.get_event_loop()
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    return loop.run_until_complete(main())
+
+    async def _grab_all(self, urls):
+        return await asyncio.gather(*[self._grab(url) for url in urls])
+
+    async def _close(self):
+        if self._browser is not None:
+            await self._browser.close()
+        self._browser = None
+        self._idle_pages = []
+        self._page_sites = {}
+
+    def grab_largest_images(self, urls):
+        """Return the largest image of each page, None when there isn't any"""
+        return self._run(self._grab_all(list(urls)))
+
+    def close(self):
+        """Close the browser - it gets launched again when needed"""
+        if self._loop is not None:
+            self._run(self._close())
+
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
+
+
+def grab_largest_images(urls):
+    """Return the largest image of each page - rendering only the ones
+    not in the scrape cache"""
+    urls = list(urls)
+    images = {url: scrape_cache.get(url, "largest_image") for url in urls}
+    missing = [url for url, image in images.items() if image is MISS]
+    if missing:
+        for url, image in zip(missing, browser_pool.grab_largest_images(missing)):
+            scrape_cache.set(url, "largest_image", image)
+            images[url] = image
+    return [images[url] for url in urls]
+
+
+def grab_largest_image(url):
+    return grab_largest_images([url])[0]
@@ -0,0 +1,55 @@
+from collectors.scrapers import cache
+from collectors.scrapers.cache import MISS, ScrapeCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_ttl_and_negative_caching(tmpdir, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    scrape_cache = ScrapeCache(
+        str(tmpdir.join("scrape.sqlite")), ttl=100, negative_ttl=10
+    )
+    scrape_cache.set("http://a", "title", "A")
+    scrape_cache.set("http://b", "title", None)  # nothing found
+    assert scrape_cache.get("http://a", "title") == "A"
+    assert scrape_cache.get("http://b", "title") is None
+    assert scrape_cache.get("http://a", "opengraph") is MISS
+
+    clock.now += 50
+    assert scrape_cache.get("http://a", "title") == "A"
+    assert scrape_cache.get("http://b", "title") is MISS
+    clock.now += 50
+    assert scrape_cache.get("http://a", "title") is MISS
+
+
+def test_cached_calls_once(tmpdir):
+    scrape_cache = ScrapeCache(str(tmpdir.join("scrape.sqlite")))
+    calls = []
+
+    @scrape_cache.cached("title")
+    def get_title(url):
+        calls.append(url)
+        return None
+
+    assert get_title("http://a") is None
+    assert get_title("http://a") is None
+    assert calls == ["http://a"]
+
+
+def test_eviction(tmpdir, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    scrape_cache = ScrapeCache(str(tmpdir.join("scrape.sqlite")), max_entries=50)
+    for i in range(100):  # the eviction runs every 100 writes
+        clock.now += 1
+        scrape_cache.set(f"http://{i}", "title", str(i))
+    assert scrape_cache.get("http://49", "title") is MISS
+    assert scrape_cache.get("http://50", "title") == "50"
+    assert scrape_cache.get("http://99", "title") == "99"
@@ -0,0 +1,47 @@
+import requests
+
+from collectors.scrapers.page_metadata import parse_metadata, read_metadata
+
+PAGE = """<html><head>
+<title> A &amp; B </title>
+<meta property="og:site_name" content="Site">
+<meta property="og:image" content="/og.png">
+<meta name="twitter:image" content="https://example.com/tw.png">
+</head><body><img src="logo.png"></body></html>"""
+
+
+def test_head_metadata():
+    metadata = parse_metadata(PAGE, "https://example.com/post/")
+    assert metadata["title"] == "A & B"
+    assert metadata["opengraph"] == {"site_name": "Site", "image": "/og.png"}
+    assert metadata["image"] == "https://example.com/og.png"
+
+
+def test_largest_img_fallback():
+    page = '<body><img src="a.png"><img src="b.png" width="80" height="60"></body>'
+    metadata = parse_metadata(page, "https://example.com/post/")
+    assert metadata["title"] is None
+    assert metadata["image"] == "https://example.com/post/b.png"
+
+
+class StalledResponse:
+    """A page sending its head, then timing out"""
+
+    headers = {"Content-Type": "text/html; charset=utf-8"}
+    encoding = "utf-8"
+
+    def iter_content(self, chunk_size):
+        yield PAGE.split("</head>")[0].encode()
+        raise requests.ConnectionError("Read timed out.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def test_stalled_page():
+    metadata = read_metadata(StalledResponse(), "https://example.com/post/")
+    assert metadata["title"] == "A & B"
+    assert metadata["image"] == "https://example.com/og.png"
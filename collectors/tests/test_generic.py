@@ -0,0 +1,17 @@
+from collectors.generic import Collector
+from storage import Storage
+from storage.tests.util import make_item
+
+
+def test_stop_at_the_previous_cursor(tmpdir):
+    db = Storage.get("sqlite", str(tmpdir.join("db.sqlite")))
+    collector = Collector(refresh_duplicates=False, db=db)
+    collector.type = "RSS"
+    collector.sync_state = dict(cursor="3")
+
+    count, stop = collector.save_items([make_item(i) for i in (5, 4, 3, 2)])
+    assert (count, stop) == (2, True)
+    assert db.known_ids("RSS") == {"4", "5"}
+    # the next run stops at the newest item of this one
+    assert collector.new_sync_state["cursor"] == "5"
+    db.close()
@@ -0,0 +1,29 @@
+from collectors import rss
+from collectors.rss import RSSCollector
+
+
+class NotModified:
+    status_code = 304
+    headers = {}
+
+
+class Session:
+    def __init__(self):
+        self.headers = []
+
+    def get(self, url, headers=None):
+        self.headers.append(headers)
+        return NotModified()
+
+
+def test_not_modified_feed(monkeypatch):
+    session = Session()
+    monkeypatch.setattr(rss, "session", session)
+    collector = RSSCollector("http://example.com/rss", refresh_duplicates=False)
+    collector.run(sync_state=dict(etag='"v1"', modified="Mon, 01 Jan 2020"))
+    assert session.headers == [
+        {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 01 Jan 2020"}
+    ]
+    # nothing is parsed or saved, the sync state stays the previous one
+    assert collector.new_sync_state == {}
+    assert collector.stats["pages"] == 0
@@ -0,0 +1,18 @@
+from collectors.urls import normalize_url
+
+
+def test_normalize_strips_tracking():
+    assert (
+        normalize_url("HTTP://WWW.Example.com/post/?utm_source=rss&b=2&a=1#comments")
+        == "https://example.com/post?a=1&b=2"
+    )
+
+
+def test_normalize_youtube():
+    assert normalize_url("https://youtu.be/xOtKWrXHwU0") == normalize_url(
+        "https://www.youtube.com/watch?v=xOtKWrXHwU0&feature=share"
+    )
+
+
+def test_normalize_empty():
+    assert normalize_url(None) is None
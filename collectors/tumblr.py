@@ -1,13 +1,14 @@
 import datetime
 import html
 import json
+import itertools
 import logging
 import re
+from contextlib import closing
 
-import requests
 from pyquery import PyQuery
 
-from collectors.exceptions import DuplicateFound
+from collectors.httpclient import session
 from collectors.rss import RSSCollector
 
 logger = logging.getLogger(__name__)
@@ -32,6 +33,7 @@ def get_src_from_iframe(iframe):
 
 class TumblrCollector(RSSCollector):
     type = "Tumblr"
+    page_size = 50  # the most the API returns at once
 
     @staticmethod
     def get(url, **feed_kwargs):
@@ -43,76 +45,84 @@ class TumblrCollector(RSSCollector):
 
         return instantiator
 
+    def get_page(self, start):
+        """Get the page of posts from start, the newest first"""
+        js_doc = session.get(
+            f"{self.url}/api/read/json", params=dict(start=start, num=self.page_size)
+        ).text
+        varvalue = js_doc.replace("var tumblr_api_read = ", "", 1).strip("\n;")
+        return json.loads(varvalue)
+
+    def items_from_page(self, doc):
+        items = []
+        for entry in doc["posts"]:
+            entry_date = datetime.datetime.strptime(
+                entry["date-gmt"], "%Y-%m-%d %H:%M:%S GMT"
+            )
+            url = entry["url-with-slug"]  # url to tumblr
+            post_type = entry["type"]
+            context = {"tumblrType": post_type}
+
+            if post_type == "video":
+                url = entry["video-source"]
+                title = entry["video-caption"]
+                context["content"] = get_src_from_iframe(entry["video-player"])
+                context["contentFormat"] = "iframe"
+            elif post_type == "photo":
+                url = entry.get("photo-link-url", url)
+                title = entry["photo-caption"]
+                context["img"] = entry["photo-url-1280"]
+            elif post_type == "link":
+                url = entry["link-url"]
+                title = entry["link-text"]
+                context["description"] = text_from_html(entry["link-description"])
+            elif post_type == "regular":
+                title = entry["regular-title"]
+                context["subTitle"] = text_from_html(entry["regular-body"])
+            elif post_type == "quote":
+                url = entry["quote-source"]
+                title = entry["quote-text"]
+            else:
+                raise ValueError("Unknown tumblr post type: {post_type}")
+            tags = entry.get("tags", [])
+            if tags:
+                context["tags"] = tags
+
+            url, title = map(text_from_html, [url, title])
+
+            item = dict(
+                type=self.type,
+                id=entry["id"],
+                timestamp=entry_date,
+                url=url,
+                title=title,
+                **context,
+            )
+            items.append(item)
+        return items
+
     def run(self, **params):
         logger.debug("Running Tumblr: %s" % self.url)
-        endpoint = f"{self.url}/api/read/json"
-        start = 0
-        count = 0
-
-        while True:
-            js_doc = requests.get(f"{endpoint}?start={start}").text
-
-            varvalue = js_doc.replace("var tumblr_api_read = ", "", 1).strip("\n;")
-            doc = json.loads(varvalue)
-
-            total = doc["posts-total"]
-
-            for entry in doc["posts"]:
-                entry_date = datetime.datetime.strptime(
-                    entry["date-gmt"], "%Y-%m-%d %H:%M:%S GMT"
-                )
-                url = entry["url-with-slug"]  # url to tumblr
-                post_type = entry["type"]
-                context = {"tumblrType": post_type}
-
-                if post_type == "video":
-                    url = entry["video-source"]
-                    title = entry["video-caption"]
-                    context["content"] = get_src_from_iframe(entry["video-player"])
-                    context["contentFormat"] = "iframe"
-                elif post_type == "photo":
-                    url = entry.get("photo-link-url", url)
-                    title = entry["photo-caption"]
-                    context["img"] = entry["photo-url-1280"]
-                elif post_type == "link":
-                    url = entry["link-url"]
-                    title = entry["link-text"]
-                    context["description"] = text_from_html(entry["link-description"])
-                elif post_type == "regular":
-                    title = entry["regular-title"]
-                    context["subTitle"] = text_from_html(entry["regular-body"])
-                elif post_type == "quote":
-                    url = entry["quote-source"]
-                    title = entry["quote-text"]
-                else:
-                    raise ValueError("Unknown tumblr post type: {post_type}")
-                tags = entry.get("tags", [])
-                if tags:
-                    context["tags"] = tags
-
-                url, title = map(text_from_html, [url, title])
-
-                item = dict(
-                    type=self.type,
-                    id=entry["id"],
-                    timestamp=entry_date,
-                    url=url,
-                    title=title,
-                    **context,
-                )
-                try:
-                    self.db.upsert(item, update=self.refresh_duplicates)
-                    logger.info(f"{self.type}-{post_type} - {title} ({url})")
-                    count += 1
-                except DuplicateFound:
-                    if not self.refresh_duplicates:
-                        logger.debug(
-                            "We already know this one. Stopping after %d added." % count
-                        )
-                        return
-                start += 1
-            if start >= total:
-                logger.debug("End of the tublr stream")
-                break
+        sync_state = params.get("sync_state") or {}
+        first_page = self.get_page(0)
+        total = int(first_page["posts-total"])
+        starts = range(self.page_size, total, self.page_size)
+        if self.refresh_duplicates or not sync_state.get("cursor"):
+            # a backfill: we get all the pages, fetching them concurrently
+            next_pages = self.fetch_pages(self.get_page, starts)
+        else:
+            # we expect to stop in the first pages
+            next_pages = (self.get_page(start) for start in starts)
 
+        count = 0
+        with closing(next_pages):
+            for doc in itertools.chain([first_page], next_pages):
+                added, known = self.save_items(self.items_from_page(doc))
+                count += added
+                if known:
+                    logger.debug(
+                        "We already know this one. Stopping after %d added." % count
+                    )
+                    return
+        logger.debug("End of the tublr stream")
         logger.debug("Runner finished, after %d added" % count)
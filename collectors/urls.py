@@ -0,0 +1,61 @@
+import re
+from urllib.parse import urlparse, parse_qs, parse_qsl, urlencode, urlunparse
+
+YOUTUBE_DOMAINS = ("youtube.com", "www.youtube.com", "m.youtube.com", "youtu.be")
+
+# query parameters that only track where the visitor comes from
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "mc_cid", "mc_eid", "igshid", "ref"}
+TRACKING_PREFIXES = ("utm_",)
+
+
+def is_youtube(url):
+    host = urlparse(url).netloc.lower()
+    return any(host == d for d in YOUTUBE_DOMAINS)
+
+
+def extract_youtube_id(url):
+    parsed = urlparse(url)
+    if parsed.netloc.lower() == "youtu.be":
+        return parsed.path.lstrip("/")
+    qs = parse_qs(parsed.query)
+    if "v" in qs:
+        return qs["v"][0]
+    match = re.search(r"/embed/([A-Za-z0-9_-]+)", parsed.path)
+    if match:
+        return match.group(1)
+    return None
+
+
+def is_tracking_param(name):
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def normalize_url(url):
+    """Return a canonical form of the url, the same for a link coming
+    from different sources (or None when there's no url)"""
+    if not url:
+        return None
+    url = url.strip()
+    if is_youtube(url):
+        video_id = extract_youtube_id(url)
+        if video_id:
+            return f"https://youtube.com/watch?v={video_id}"
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parsed.port and parsed.port not in (80, 443):
+        host = f"{host}:{parsed.port}"
+    path = parsed.path.rstrip("/")
+    query = urlencode(
+        sorted(
+            (name, value)
+            for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+            if not is_tracking_param(name)
+        )
+    )
+    return urlunparse((scheme, host, path, parsed.params, query, ""))
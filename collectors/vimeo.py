@@ -6,13 +6,18 @@ import os
 import vimeo
 
 from collectors.generic import OAuthCollector
-from collectors.exceptions import DuplicateFound
 
 logger = logging.getLogger(__name__)
 
 
 class VimeoCollector(OAuthCollector):
     type = "Vimeo"
+    page_size = 100  # the most the API returns at once
+    # the parts of the videos we use
+    fields = (
+        "uri,name,link,description,pictures.sizes,tags.name,"
+        "metadata.interactions.like.added,metadata.interactions.like.added_time"
+    )
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
@@ -80,10 +85,14 @@ class VimeoCollector(OAuthCollector):
     def run(self, **params):
         self.authenticate()  # self.vimeo will be ready
 
-        likes = self.vimeo.get("/me/likes")
+        page = 1
         count = 0
         while True:
-            response = likes.json()
+            response = self.vimeo.get(
+                "/me/likes",
+                params=dict(page=page, per_page=self.page_size, fields=self.fields),
+            ).json()
+            items = []
             for video in response["data"]:
                 assert video["metadata"]["interactions"]["like"]["added"] == True
                 liked_timestamp = parse_datetime(
@@ -102,25 +111,17 @@ class VimeoCollector(OAuthCollector):
                     thumbnails=video["pictures"],
                     tags=[t["name"] for t in video["tags"]],
                 )
-                try:
-                    self.db.upsert(item, update=self.refresh_duplicates)
-                    logger.info(
-                        "{type} - {title} ({id})".format(
-                            type=self.type, title=title, id=video_id
-                        )
-                    )
-                    count += 1
-                except DuplicateFound:
-                    if not self.refresh_duplicates:
-                        logger.debug(
-                            "We already know this one. Stopping after %d added." % count
-                        )
-                        return
-            next_page = response["paging"]["next"]
-            if next_page:
-                likes = self.vimeo.get(next_page)
-            else:
+                items.append(item)
+            added, known = self.save_items(items)
+            count += added
+            if known:
+                logger.debug(
+                    "We already know this one. Stopping after %d added." % count
+                )
+                return
+            if not response["paging"]["next"]:
                 break
+            page += 1
 
         logger.debug("Runner finished, after %d added" % count)
 
@@ -1,16 +1,19 @@
 import datetime
+import hashlib
 import logging
 import os
+import threading
+import time
 from argparse import Namespace
 
-import httplib2
 from googleapiclient.discovery import build
+from googleapiclient.discovery_cache.base import Cache
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.file import Storage
 from oauth2client.tools import run_flow
 
-from .exceptions import DuplicateFound
 from .generic import Collector
+from .httpclient import new_httplib2
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +32,33 @@ def parse_datetime(timestamp):
     raise ValueError(f"Cannot find a valid format for {timestamp}")
 
 
+class DiscoveryCache(Cache):
+    """Keep the discovery documents of the Google APIs in files, for a day"""
+
+    folder = os.path.join("cache", "discovery")
+    max_age = 24 * 60 * 60
+
+    def filename(self, url):
+        return os.path.join(self.folder, hashlib.sha1(url.encode()).hexdigest())
+
+    def get(self, url):
+        filename = self.filename(url)
+        try:
+            if time.time() - os.path.getmtime(filename) > self.max_age:
+                return None
+            with open(filename, encoding="utf8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, url, content):
+        os.makedirs(self.folder, exist_ok=True)
+        filename = self.filename(url)
+        with open(filename + ".tmp", "w", encoding="utf8") as f:
+            f.write(content)
+        os.replace(filename + ".tmp", filename)
+
+
 class YouTubeLikesCollector(Collector):
     CLIENT_SECRETS_FILE = os.path.join("appkeys", "google.json")
     YOUTUBE_READONLY_SCOPE = "https://www.googleapis.com/auth/youtube.readonly"
@@ -36,6 +66,19 @@ class YouTubeLikesCollector(Collector):
     YOUTUBE_API_VERSION = "v3"
     type = "Youtube"
     subtype = "like"
+    page_size = 50  # the most the API returns at once
+    playlist_fields = (
+        "nextPageToken,items(status/privacyStatus,"
+        "snippet(title,description,publishedAt,thumbnails,resourceId/videoId))"
+    )
+
+    # the credentials and the API client, shared by the YouTube collectors
+    _client = {}
+    _client_lock = threading.Lock()
+
+    @property
+    def sync_key(self):
+        return f"{self.type}:{self.subtype}"
 
     def get_credentials(self):
         flow = flow_from_clientsecrets(
@@ -56,21 +99,41 @@ class YouTubeLikesCollector(Collector):
             credentials = run_flow(flow, storage, flags=flags)
         return credentials
 
+    def get_client(self):
+        """Return the API client and an authorized http for this collector
+
+        The client is built once (and the authentication done once) for all
+        the YouTube collectors. httplib2 is not thread safe: each collector
+        executes the requests with its own http.
+        """
+        with self._client_lock:
+            if not self._client:
+                credentials = self.get_credentials()
+                self._client.update(
+                    credentials=credentials,
+                    youtube=build(
+                        self.YOUTUBE_API_SERVICE_NAME,
+                        self.YOUTUBE_API_VERSION,
+                        http=credentials.authorize(new_httplib2()),
+                        cache=DiscoveryCache(),
+                    ),
+                )
+        http = self._client["credentials"].authorize(new_httplib2())
+        return self._client["youtube"], http
+
     def run(self, **params):
-        refresh_duplicates = self.refresh_duplicates
-        credentials = self.get_credentials()
-
-        youtube = build(
-            self.YOUTUBE_API_SERVICE_NAME,
-            self.YOUTUBE_API_VERSION,
-            http=credentials.authorize(httplib2.Http()),
-            cache_discovery=False,  # cache is disabled with oauthclient >= 4.0.0
-        )
+        youtube, http = self.get_client()
 
         logger.debug("Running %s collector." % self.type)
 
         channels_response = (
-            youtube.channels().list(mine=True, part="contentDetails").execute()
+            youtube.channels()
+            .list(
+                mine=True,
+                part="contentDetails",
+                fields="items/contentDetails/relatedPlaylists",
+            )
+            .execute(http=http)
         )
 
         count = 0
@@ -78,11 +141,17 @@ class YouTubeLikesCollector(Collector):
             list_id = self.get_list_id(channel)
 
             playlistitems_list_request = youtube.playlistItems().list(
-                playlistId=list_id, part="snippet,status", maxResults=5
+                playlistId=list_id,
+                part="snippet,status",
+                maxResults=self.page_size,
+                fields=self.playlist_fields,
             )
 
             while playlistitems_list_request:
-                playlistitems_list_response = playlistitems_list_request.execute()
+                playlistitems_list_response = playlistitems_list_request.execute(
+                    http=http
+                )
+                items = []
 
                 # Print information about each video.
                 for playlist_item in playlistitems_list_response["items"]:
@@ -121,21 +190,15 @@ class YouTubeLikesCollector(Collector):
                         item["thumb"] = item["thumbnails"]["medium"]["url"]
                     except:
                         pass
-                    try:
-                        self.db.upsert(item, update=refresh_duplicates)
-                        logger.info(
-                            "{type} - {title} ({id})".format(
-                                type=self.type, title=title, id=video_id
-                            )
-                        )
-                        count += 1
-                    except DuplicateFound:
-                        if not refresh_duplicates:
-                            logger.debug(
-                                "We already know this one. Stopping after %d added."
-                                % count
-                            )
-                            return
+                    items.append(item)
+
+                added, known = self.save_items(items)
+                count += added
+                if known:
+                    logger.debug(
+                        "We already know this one. Stopping after %d added." % count
+                    )
+                    return
 
                 playlistitems_list_request = youtube.playlistItems().list_next(
                     playlistitems_list_request, playlistitems_list_response
@@ -3,10 +3,13 @@ import argparse
 import datetime
 import json
 import logging
+import math
 import os
 import sys
 import textwrap
+import time
 import collections
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 
 
 def _patch_collections_for_py3():
@@ -30,16 +33,18 @@ _patch_collections_for_py3()
 from sing import single
 
 from collectors import *
+from collectors.exceptions import CollectorTimeout
 from collectors.rss import RSSCollector
 from collectors.scrapers.grab_opengraph import fill_missing_infos
 from collectors.youtube import YouTubeMineCollector
 from flatbuilder.builder import Builder, Template, NotATemplateFolder
 from flatbuilder.preview import serve
-from storage import Storage
+from storage import Storage, SerializedStorage
 
 logger = logging.getLogger(__name__)
 VERSION = "1.1"
 TEMPLATE_CONTAINER_FOLDER = "flatbuilder"
+BUILD_SYNC_KEY = "build"  # the sync state of the builder
 PROJECT_PATH = os.path.dirname(__file__)
 os.chdir(PROJECT_PATH)
 
@@ -68,8 +73,14 @@ class Aggregator:
         self.db_filename = c("db", "db.json")
         self.db_format = c("format", "json")
         self.build_template = c("template", "empty")
+        self.collect_workers = c("collect_workers", 4)
+        self.collect_timeout = c("collect_timeout", 600)  # seconds per collector
+        storage_options = {}
+        if self.db_format == "sqlite":
+            # skip the links we already got from another source
+            storage_options["dedupe_urls"] = c("dedupe_urls", True)
 
-        self.db = Storage.get(self.db_format, self.db_filename)
+        self.db = Storage.get(self.db_format, self.db_filename, **storage_options)
 
     @staticmethod
     def load_config(config_file=os.path.join(PROJECT_PATH, "flat.json")):
@@ -79,22 +90,91 @@ class Aggregator:
                 return json.load(f)
         return {}
 
-    def collect(self, refresh_duplicates=False):
-        logger.info("Running the Collectors")
-        for collector_class in self.collectors:
-            logger.debug(collector_class.__name__)
-            collector = collector_class(
-                refresh_duplicates=refresh_duplicates,
-                db=self.db,
-            )
-            # we can decide the initial collect parameter looking at the DB?
+    def run_collector(self, collector):
+        """Run a collector and return its outcome, it never raises"""
+        start = time.monotonic()
+        if self.collect_timeout:
+            collector.deadline = start + self.collect_timeout
+        try:
+            # the initial collect parameters come from the previous run state
             initial_collect_params = collector.initial_parameters()
             # Run the collector
             collector.run(**initial_collect_params)
+        except CollectorTimeout:
+            logger.error(f"{collector.sync_key} timed out, stopped")
+            outcome = "timeout"
+        except Exception:
+            logger.exception(f"{collector.sync_key} failed")
+            outcome = "failed"
+        else:
+            # an interrupted run would skip what it didn't reach, we keep the old state
+            collector.db.set_sync_state(
+                collector.sync_key,
+                **collector.new_sync_state,
+                last_run=datetime.datetime.utcnow(),
+                stats=collector.stats,
+            )
+            outcome = "ok"
+        return dict(
+            name=collector.sync_key,
+            outcome=outcome,
+            elapsed=time.monotonic() - start,
+            stats=collector.stats,
+        )
+
+    def collect(self, refresh_duplicates=False):
+        """Run the collectors concurrently, they write through a single writer
+        - return the outcome of each of them"""
+        logger.info("Running the Collectors")
+        start = time.monotonic()
+        db = SerializedStorage(self.db)
+        collectors = [
+            collector_class(refresh_duplicates=refresh_duplicates, db=db)
+            for collector_class in self.collectors
+        ]
+        executor = ThreadPoolExecutor(
+            max_workers=self.collect_workers, thread_name_prefix="collector"
+        )
+        runs = [
+            executor.submit(self.run_collector, collector) for collector in collectors
+        ]
+        wait_until = None
+        if self.collect_timeout:
+            # a collector stuck before checking its deadline is not waited for
+            rounds = math.ceil(len(collectors) / self.collect_workers)
+            wait_until = start + self.collect_timeout * rounds
+        results = []
+        for collector, run in zip(collectors, runs):
+            timeout = None
+            if wait_until is not None:
+                timeout = max(wait_until - time.monotonic(), 0)
+            try:
+                results.append(run.result(timeout=timeout))
+            except FuturesTimeoutError:
+                logger.error(f"{collector.sync_key} timed out, left behind")
+                results.append(
+                    dict(
+                        name=collector.sync_key,
+                        outcome="timeout",
+                        elapsed=time.monotonic() - start,
+                        stats=collector.stats,
+                    )
+                )
+        executor.shutdown(wait=False, cancel_futures=True)
+        db.close()
+
+        for result in results:
+            logger.info(
+                "{name}: {outcome} in {elapsed:.1f}s"
+                " - {added} added, {pages} pages".format(**result, **result["stats"])
+            )
         fill_missing_infos(self.db)
         self.db.close()
+        return results
 
-    def build(self, folder="build"):
+    def build(self, folder="build", only_changed=False):
+        """Build the static site - with only_changed we skip it when no item
+        changed since the previous build"""
         if not os.path.isdir(folder):
             logger.warning("Build target folder '%s' not found." % folder)
             logger.warning("Create it from a template with the 'init' action.")
@@ -103,8 +183,24 @@ class Aggregator:
         logger.info("  DB: %s" % self.db)
         logger.info("  target folder: %s" % folder)
 
+        if self.db.has_changelog:
+            last_seq = self.db.get_sync_state(BUILD_SYNC_KEY).get("change_seq")
+            if (
+                only_changed
+                and last_seq is not None
+                and not self.db.changes_since(last_seq, limit=1)
+            ):
+                logger.info("No item changed since the last build")
+                return
+            # what changes after this gets built the next time
+            last_seq = self.db.last_change_seq()
+
         builder = Builder()
-        builder.run(items=self.db.all(), folder=folder)
+        built = builder.run(items=self.db.iter_items, folder=folder)
+        if built and self.db.has_changelog:
+            self.db.set_sync_state(
+                BUILD_SYNC_KEY, change_seq=last_seq, last_run=datetime.datetime.utcnow()
+            )
 
     @staticmethod
     def preview():
@@ -254,7 +350,7 @@ if __name__ == "__main__":
         agg.send_push_history()  # notify after collection
 
     if action in ("collect+build", "build"):
-        agg.build()
+        agg.build(only_changed=action == "collect+build")
 
     if action == "init":
         agg.init(template_name=args.template)
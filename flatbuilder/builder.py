@@ -38,7 +38,9 @@ class Builder:
             recursive_overwrite(template_folder, self.build_folder)
 
     def run(self, items, folder):
-        """Given an iterable of items generate the flat static site"""
+        """Given a function returning the iterator of the items generate
+        the flat static site - the function accepts an optional limit and
+        the fields to read - return True when the site got generated"""
         logger.info("Generating the flat site in %s" % folder)
         try:
             template = Template(folder, build_folder=self.build_folder)
@@ -47,9 +49,10 @@ class Builder:
                 "Build folder doesn't seem coming from a template, we need %s"
                 % CONFIG_FILENAME
             )
-            return
+            return False
 
         template.process(items)
+        return True
 
 
 class NotATemplateFolder(Exception):
@@ -122,10 +125,12 @@ class Template:
         env = Environment(loader=FileSystemLoader(template_folder))
         template = env.get_template("templates/item.inc.html")
 
+        # the templates can list the item fields they use, to read just them
+        fields = self.config.get("fields")
         if page_type == "all":
-            src = items
+            src = items(fields=fields)
         elif page_type == "top":
-            src = items[: page["count"]]
+            src = items(limit=page["count"], fields=fields)
         else:
             raise Exception("What kind of page is %s?" % page_type)
 
@@ -15,7 +15,7 @@ if __name__ == "__main__":
     logger.info("Clearing the build folder")
     builder = Builder()
     build_folder = "build"
-    builder.run(items=[], folder=build_folder)
+    builder.run(items=lambda **kwargs: iter(()), folder=build_folder)
     template_folder = os.path.dirname(__file__)
     logger.info("Copy back to this template folder: %s" % template_folder)
     recursive_overwrite(src=build_folder, dest=template_folder)
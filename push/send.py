@@ -1,3 +1,4 @@
+import datetime
 import json
 import logging
 import os
@@ -66,28 +67,54 @@ def broadcast_notification(data, db):
         send_notification(data, subscription, db)
 
 
+PUSH_SYNC_KEY = "push"  # the sync state of the notifications
+PUSH_FIELDS = ("title", "thumb", "url", "timestamp")
+
+
+def new_items_since(db, seq, last_seq):
+    """The visible items inserted between the two checkpoints, the oldest first"""
+    inserted_ids = {
+        change["id"]
+        for change in db.changes_since(seq)
+        if change["operation"] == "insert" and change["seq"] <= last_seq
+    }
+    items = [db.getitem(item_id) for item_id in inserted_ids]
+    items = [item for item in items if item and not item.get("hidden")]
+    return sorted(items, key=lambda item: item["timestamp"])
+
+
 def send_all_missing_notifications(db):
     subscriptions = db.active_subscriptions()
-
-    if not subscriptions:
-        return
-    min_date = subscriptions[0].min_date
-    for subscription in subscriptions[1:]:
-        min_date = min(min_date, subscription.min_date)
-
-    items = list(filter(lambda item: item["timestamp"] > min_date, db.all()))
-
-    logger.debug(f"Notifications for {len(items)} items")
-
-    for subitem in subscriptions:
-        start_date = subitem.min_date
-        for item in items:
-            if item["timestamp"] > start_date:
-                data = dict(
-                    title="Dario Varotto shared",
-                    body=item["title"],
-                    image=item["thumb"],
-                    url=item["url"],
-                )
-                print(f"Notifying {data} to {subitem.id}")
-                send_notification(data, subitem.subscription, db)
+    # the changes after this checkpoint are left for the next run
+    last_seq = db.last_change_seq()
+    seq = db.get_sync_state(PUSH_SYNC_KEY).get("change_seq")
+
+    if subscriptions:
+        min_date = subscriptions[0].min_date
+        for subscription in subscriptions[1:]:
+            min_date = min(min_date, subscription.min_date)
+
+        if seq is None:
+            # the first run: we look for the new items by timestamp
+            items = list(db.iter_items(since=min_date, fields=PUSH_FIELDS))
+        else:
+            items = new_items_since(db, seq, last_seq)
+
+        logger.debug(f"Notifications for {len(items)} items")
+
+        for subitem in subscriptions:
+            start_date = subitem.min_date
+            for item in items:
+                if item["timestamp"] > start_date:
+                    data = dict(
+                        title="Dario Varotto shared",
+                        body=item["title"],
+                        image=item.get("thumb"),
+                        url=item["url"],
+                    )
+                    print(f"Notifying {data} to {subitem.id}")
+                    send_notification(data, subitem.subscription, db)
+
+    db.set_sync_state(
+        PUSH_SYNC_KEY, change_seq=last_seq, last_run=datetime.datetime.utcnow()
+    )
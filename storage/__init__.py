@@ -1 +1,10 @@
-from .db import Storage
+from .db import (
+    Storage,
+    INSERTED,
+    UPDATED,
+    UNCHANGED,
+    DUPLICATE,
+    DUPLICATE_URL,
+    content_hash,
+)
+from .writer import SerializedStorage
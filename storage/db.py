@@ -1,19 +1,42 @@
+import hashlib
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# the status of each item written by Storage.upsert_many
+INSERTED = "inserted"
+UPDATED = "updated"
+DUPLICATE = "duplicate"
+DUPLICATE_URL = "duplicate_url"  # new id, but we have the same url from elsewhere
+UNCHANGED = "unchanged"  # updating, but nothing changed
+
+
+def content_hash(item):
+    """A hash of the item content, to skip the updates that don't change it
+    (hidden is managed by the admin, not by the collectors)"""
+    content = {k: v for k, v in item.items() if k != "hidden"}
+    canonical = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode("utf8")).hexdigest()
+
 
 class Storage:
+    has_changelog = False  # if the changes_since feed is available
+
     @staticmethod
-    def get(db_format, db_filename):
+    def get(db_format, db_filename, **options):
         if db_format == "json":
             from .json import StorageTinyDB
 
             db = StorageTinyDB(db_filename=db_filename)
+        elif db_format == "jsonl":
+            from .jsonl import StorageJSONL
+
+            db = StorageJSONL(db_filename)
         elif db_format == "sqlite":
             from .sql import StorageSqliteDB
 
-            db = StorageSqliteDB(db_filename)
+            db = StorageSqliteDB(db_filename, **options)
         else:
             db = Storage()
         return db
@@ -24,20 +47,93 @@ class Storage:
     def all(self):
         raise NotImplementedError()
 
+    def iter_items(
+        self,
+        order="desc",
+        since=None,
+        types=None,
+        limit=None,
+        batch_size=500,
+        fields=None,
+    ):
+        """Iterate over the visible items sorted by timestamp
+
+        :param order: "desc" to get the newest first, "asc" otherwise
+        :param since: get only the items with a timestamp after this
+        :param types: get only the items of these types
+        :param limit: stop after this number of items
+        :param batch_size: how many items are fetched from the DB at once
+        :param fields: the fields used by the caller, when given the storage
+                       can skip reading the others
+        """
+        raise NotImplementedError()
+
     def getitem(self, item_id):
         raise NotImplementedError()
 
-    def upsert(self, item, update=False):
+    def upsert(self, item, update=False, update_hash=True):
+        """Insert the item (or update it when update is set)
+        Return True when something changed"""
+        raise NotImplementedError
+
+    def upsert_many(self, items, update=False, update_hash=True):
+        """Write a batch of items in a single transaction
+
+        The updated items are merged over the stored ones. Without update_hash
+        they are not what a collector got (an enrichment, an admin change):
+        the content hash stays the one of the collected item.
+
+        Return the status of each item (INSERTED, UPDATED, UNCHANGED, DUPLICATE
+        or DUPLICATE_URL) in the same order they were given
+        """
+        raise NotImplementedError
+
+    def items_needing_enrichment(self, limit=None):
+        """Return the visible items never enriched (their thumb is missing),
+        the newest first - an empty thumb means we didn't find any"""
+        raise NotImplementedError
+
+    def known_ids(self, type, ids=None):
+        """Return the set of ids of the items of this type we have
+        - when ids are given, just the ones among them"""
         raise NotImplementedError
 
     def max_timestamp(self, **kwargs):
         raise NotImplementedError
 
+    # items change feed ***
+
+    def changes_since(self, seq=0, limit=None):
+        """Return the items changes after the seq checkpoint, the oldest first
+
+        Each change is a dictionary with the seq, the id and type of the item,
+        the operation (insert, update, hide or delete) and when it happened
+        """
+        raise NotImplementedError
+
+    def last_change_seq(self):
+        """The seq of the latest change, a checkpoint for changes_since"""
+        raise NotImplementedError
+
+    # collectors sync state ***
+
+    def get_sync_state(self, key):
+        """Return the state saved by the last run of a collector as a dictionary
+        (cursor, etag, modified, last_timestamp, last_run, stats)"""
+        raise NotImplementedError
+
+    def set_sync_state(self, key, **state):
+        """Update the given fields of the state of a collector"""
+        raise NotImplementedError
+
     # generic ***
 
     def close(self):
         raise NotImplementedError
 
+    def release_thread(self):
+        """Free what the calling thread holds, when it's done with the storage"""
+
     # push notifications ***
 
     def active_subscriptions(self):
@@ -1,9 +1,10 @@
+import itertools
 import logging
 
 from tinydb import TinyDB, Query
 
 from collectors.exceptions import DuplicateFound
-from storage import Storage
+from storage import Storage, INSERTED, UPDATED, UNCHANGED, DUPLICATE
 
 logger = logging.getLogger(__name__)
 
@@ -13,41 +14,141 @@ class StorageTinyDB(Storage):
         super().__init__()
         self.db_filename = db_filename
         self.db = TinyDB(db_filename)
+        self.sync_states = self.db.table("sync_state")
+        self._build_index()
+
+    def _build_index(self):
+        """Keep the document ids by (id, type) and the max timestamp of each type,
+        so we don't have to scan all the documents for each lookup"""
+        self._doc_ids = {}
+        self._max_timestamps = {}
+        for document in self.db.all():
+            self._index(document, document.doc_id)
+
+    def _index(self, item, doc_id):
+        item_type = item["type"]
+        self._doc_ids[(item["id"], item_type)] = doc_id
+        max_timestamp = self._max_timestamps.get(item_type)
+        if max_timestamp is None or item["timestamp"] > max_timestamp:
+            self._max_timestamps[item_type] = item["timestamp"]
 
     def search(self, id=None, type=None):
         Item = Query()
         if type and id:
-            return self.db.search((Item.id == id) & (Item.type == type))
+            doc_id = self._doc_ids.get((id, type))
+            return [self.db.get(doc_id=doc_id)] if doc_id else []
         elif type:
             return self.db.search(Item.type == type)
         elif id:
             return self.db.search(Item.id == id)
 
-    def upsert(self, item, update=False):
-        existing = self.search(id=item["id"], type=item["type"])
-        if existing:
-            assert len(existing) == 1, (
-                "We have 2 duplicates with id: {id} and type: {type}".format(
-                    id=item["id"], type=item["type"]
+    def upsert(self, item, update=False, update_hash=True):
+        doc_id = self._doc_ids.get((item["id"], item["type"]))
+        if doc_id:
+            if not update:
+                raise DuplicateFound(
+                    f"We already have the id {item['id']} of type {item['type']}"
+                    " in the DB"
                 )
-            )
-            existing = existing[0]
-            if update:
-                existing.update(item)
-                logger.info("Updating: %s" % item)
-                self.db.update(existing, eids=[existing.eid])
-            raise DuplicateFound(
-                f"We already have the id {item['id']} of type {item['type']} in the DB"
-            )
+            document = self.db.get(doc_id=doc_id)
+            if {**document, **item} == document:
+                return False
+            logger.info("Updating: %s" % item)
+            self.db.update(item, doc_ids=[doc_id])
+            self._index(item, doc_id)
+            return True
         logger.info("Adding: %s" % item)
-        self.db.insert(item)
+        doc_id = self.db.insert(item)
+        self._index(item, doc_id)
+        return True
+
+    def upsert_many(self, items, update=False, update_hash=True):
+        """Write a page of items - all the new ones get inserted at once,
+        all the updated ones are written back together
+        (the merged items are compared, we don't keep a content hash)"""
+        statuses = []
+        inserted = {}
+        updated = {}
+        documents = None
+        for item in items:
+            key = (item["id"], item["type"])
+            if key not in inserted and key not in self._doc_ids:
+                logger.info("Adding: %s" % item)
+                inserted[key] = dict(item)
+                statuses.append(INSERTED)
+                continue
+            if not update:
+                statuses.append(DUPLICATE)
+                continue
+            if key in inserted:
+                target = inserted[key]
+            else:
+                if documents is None:
+                    # read the existing documents once, to write them back merged
+                    documents = {
+                        document.doc_id: document for document in self.db.all()
+                    }
+                target = documents[self._doc_ids[key]]
+            if {**target, **item} == target:
+                statuses.append(UNCHANGED)
+                continue
+            logger.info("Updating: %s" % item)
+            target.update(item)
+            if key not in inserted:
+                updated[key] = target
+            statuses.append(UPDATED)
+
+        if updated:
+            for document in updated.values():
+                self._index(document, document.doc_id)
+            self.db.write_back(list(updated.values()))
+        if inserted:
+            doc_ids = self.db.insert_multiple(inserted.values())
+            for item, doc_id in zip(inserted.values(), doc_ids):
+                self._index(item, doc_id)
+        return statuses
 
     def all(self):
         data = self.db.all()
         data.sort(key=lambda item: item["timestamp"], reverse=True)
         return data
 
+    def iter_items(
+        self,
+        order="desc",
+        since=None,
+        types=None,
+        limit=None,
+        batch_size=500,
+        fields=None,
+    ):
+        # TinyDB reads the whole file anyway, we filter and sort in memory
+        data = [
+            item
+            for item in self.db.all()
+            if not item.get("hidden")
+            and (since is None or item["timestamp"] > since)
+            and (not types or item["type"] in types)
+        ]
+        data.sort(key=lambda item: item["timestamp"], reverse=order == "desc")
+        yield from data[:limit]
+
+    def items_needing_enrichment(self, limit=None):
+        items = (item for item in self.iter_items() if item.get("thumb") is None)
+        return list(itertools.islice(items, limit))
+
+    def known_ids(self, type, ids=None):
+        if ids is None:
+            return {
+                item_id for item_id, item_type in self._doc_ids if item_type == type
+            }
+        return {item_id for item_id in ids if (item_id, type) in self._doc_ids}
+
     def max_timestamp(self, **kwargs):
+        if set(kwargs) == {"type"}:
+            return self._max_timestamps.get(kwargs["type"])
+        if not kwargs:
+            return max(self._max_timestamps.values(), default=None)
         items = self.search(**kwargs)
         # we scan all item to get the max_timestamp
         max_timestamp = None
@@ -56,6 +157,13 @@ class StorageTinyDB(Storage):
                 max_timestamp = item["timestamp"]
         return max_timestamp
 
+    def get_sync_state(self, key):
+        state = self.sync_states.get(Query().key == key)
+        return dict(state) if state else {}
+
+    def set_sync_state(self, key, **state):
+        self.sync_states.upsert(dict(state, key=key), Query().key == key)
+
     def __str__(self):
         return "DB: %s" % self.db_filename
 
@@ -0,0 +1,304 @@
+"""Log-structured storage: the items are appended to a JSONL file
+
+Every write appends the full item as a new line, and an in-memory index
+keeps the position of the latest version of each (id, type).
+The stale versions are dropped by compact(), that runs in background
+when they outnumber the live ones.
+"""
+import datetime
+import itertools
+import json
+import logging
+import mmap
+import os
+import threading
+from collections import namedtuple
+
+from collectors.exceptions import DuplicateFound
+from storage import Storage, INSERTED, UPDATED, UNCHANGED, DUPLICATE
+
+logger = logging.getLogger(__name__)
+
+# where the latest version of an item is, with what we need to filter and sort it
+Entry = namedtuple("Entry", "offset length timestamp hidden")
+
+
+def encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def decode(obj):
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def dump_record(item):
+    return json.dumps(item, default=encode, ensure_ascii=False).encode("utf8") + b"\n"
+
+
+def load_record(data):
+    return json.loads(data, object_hook=decode)
+
+
+class StorageJSONL(Storage):
+    # don't compact small logs, even when they are mostly stale
+    compact_min_records = 1000
+
+    def __init__(self, db_filename):
+        super().__init__()
+        self.db_filename = db_filename
+        # the collectors sync state is small, we keep it in a json aside
+        self.sync_state_filename = db_filename + ".state"
+        self._lock = threading.RLock()
+        self._compaction = None
+        self._open()
+
+    def _open(self):
+        self._file = open(self.db_filename, "a+b")
+        self._size = os.fstat(self._file.fileno()).st_size
+        self._mmap = None
+        self._index = {}
+        self._records = 0
+        self._max_timestamps = {}
+        self._scan(0)
+
+    def _close_files(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def _remap(self):
+        """Map the file again when it grew after the last mapping"""
+        if self._mmap is not None and len(self._mmap) >= self._size:
+            return
+        if self._mmap is not None:
+            self._mmap.close()
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _scan(self, start):
+        """Index the records of the log from the start offset"""
+        if self._size <= start:
+            return
+        self._remap()
+        position = start
+        while position < self._size:
+            end = self._mmap.find(b"\n", position, self._size)
+            if end == -1:
+                logger.warning(
+                    f"Truncating the incomplete record at {position} of {self}"
+                )
+                self._mmap.close()
+                self._mmap = None
+                self._file.truncate(position)
+                self._size = position
+                break
+            length = end + 1 - position
+            record = load_record(self._mmap[position : end + 1])
+            self._add_to_index(record, position, length)
+            position = end + 1
+
+    def _add_to_index(self, item, offset, length):
+        item_type = item["type"]
+        self._index[(item["id"], item_type)] = Entry(
+            offset, length, item["timestamp"], bool(item.get("hidden"))
+        )
+        self._records += 1
+        max_timestamp = self._max_timestamps.get(item_type)
+        if max_timestamp is None or item["timestamp"] > max_timestamp:
+            self._max_timestamps[item_type] = item["timestamp"]
+
+    def _read(self, key):
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                return None
+            self._remap()
+            return load_record(self._mmap[entry.offset : entry.offset + entry.length])
+
+    def _append(self, items):
+        """Append the items to the log with a single write"""
+        records = [dump_record(item) for item in items]
+        with self._lock:
+            self._file.write(b"".join(records))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            offset = self._size
+            for item, record in zip(items, records):
+                self._add_to_index(item, offset, len(record))
+                offset += len(record)
+            self._size = offset
+        self._maybe_compact()
+
+    def search(self, id=None, type=None):
+        if type and id:
+            item = self._read((id, type))
+            return [item] if item else []
+        with self._lock:
+            keys = [
+                key
+                for key in self._index
+                if (id is None or key[0] == id) and (type is None or key[1] == type)
+            ]
+        return [self._read(key) for key in keys]
+
+    def getitem(self, item_id):
+        items = self.search(id=item_id)
+        return items[0] if items else None
+
+    def upsert(self, item, update=False, update_hash=True):
+        (status,) = self.upsert_many([item], update=update)
+        if status == DUPLICATE:
+            raise DuplicateFound(
+                f"We already have the id {item['id']} of type {item['type']} in the DB"
+            )
+        return status != UNCHANGED
+
+    def upsert_many(self, items, update=False, update_hash=True):
+        """Write a page of items with a single append
+        (the merged items are compared, we don't keep a content hash)"""
+        statuses = []
+        written = {}
+        for item in items:
+            key = (item["id"], item["type"])
+            existing = written.get(key) or self._read(key)
+            if not existing:
+                logger.info("Adding: %s" % item)
+                written[key] = dict(item)
+                statuses.append(INSERTED)
+            elif not update:
+                statuses.append(DUPLICATE)
+            elif {**existing, **item} == existing:
+                statuses.append(UNCHANGED)
+            else:
+                logger.info("Updating: %s" % item)
+                written[key] = {**existing, **item}
+                statuses.append(UPDATED)
+        if written:
+            self._append(list(written.values()))
+        return statuses
+
+    def all(self):
+        return list(self.iter_items())
+
+    def iter_items(
+        self,
+        order="desc",
+        since=None,
+        types=None,
+        limit=None,
+        batch_size=500,
+        fields=None,
+    ):
+        with self._lock:
+            entries = [
+                (key, entry)
+                for key, entry in self._index.items()
+                if not entry.hidden
+                and (since is None or entry.timestamp > since)
+                and (not types or key[1] in types)
+            ]
+        entries.sort(key=lambda key_entry: key_entry[1].timestamp)
+        if order == "desc":
+            entries.reverse()
+        for key, entry in entries[:limit]:
+            # read by key: a compaction could have moved the record
+            item = self._read(key)
+            if item is not None:
+                yield item
+
+    def items_needing_enrichment(self, limit=None):
+        items = (item for item in self.iter_items() if item.get("thumb") is None)
+        return list(itertools.islice(items, limit))
+
+    def known_ids(self, type, ids=None):
+        if ids is None:
+            with self._lock:
+                return {
+                    item_id for item_id, item_type in self._index if item_type == type
+                }
+        return {item_id for item_id in ids if (item_id, type) in self._index}
+
+    def max_timestamp(self, **kwargs):
+        if set(kwargs) == {"type"}:
+            return self._max_timestamps.get(kwargs["type"])
+        if not kwargs:
+            return max(self._max_timestamps.values(), default=None)
+        return max((item["timestamp"] for item in self.search(**kwargs)), default=None)
+
+    def _load_sync_states(self):
+        if not os.path.isfile(self.sync_state_filename):
+            return {}
+        with open(self.sync_state_filename, "rb") as f:
+            return load_record(f.read())
+
+    def get_sync_state(self, key):
+        with self._lock:
+            return self._load_sync_states().get(key, {})
+
+    def set_sync_state(self, key, **state):
+        with self._lock:
+            states = self._load_sync_states()
+            states.setdefault(key, {}).update(state)
+            temp_filename = self.sync_state_filename + ".tmp"
+            with open(temp_filename, "wb") as f:
+                f.write(dump_record(states))
+            os.replace(temp_filename, self.sync_state_filename)
+
+    # compaction ***
+
+    def _maybe_compact(self):
+        if self._records < self.compact_min_records:
+            return
+        if self._records <= 2 * len(self._index):
+            return
+        if self._compaction and self._compaction.is_alive():
+            return
+        self._compaction = threading.Thread(
+            target=self.compact, name="jsonl-compaction", daemon=True
+        )
+        self._compaction.start()
+
+    def compact(self):
+        """Rewrite the log keeping only the latest version of each item"""
+        with self._lock:
+            snapshot = sorted(self._index.items(), key=lambda kv: kv[1].offset)
+            end = self._size
+        logger.info(f"Compacting {self}: {self._records} records to {len(snapshot)}")
+        compact_filename = self.db_filename + ".compact"
+        new_index = {}
+        with open(self.db_filename, "rb") as source:
+            with open(compact_filename, "wb") as target:
+                # the log before the end is never changed: we copy it without locking
+                for key, entry in snapshot:
+                    source.seek(entry.offset)
+                    new_index[key] = entry._replace(offset=target.tell())
+                    target.write(source.read(entry.length))
+
+                with self._lock:
+                    # then we add what got appended in the meantime
+                    source.seek(end)
+                    tail_start = target.tell()
+                    target.write(source.read(self._size - end))
+                    target.flush()
+                    os.fsync(target.fileno())
+
+                    self._close_files()
+                    os.replace(compact_filename, self.db_filename)
+                    self._file = open(self.db_filename, "a+b")
+                    self._size = os.fstat(self._file.fileno()).st_size
+                    self._index = new_index
+                    self._records = len(new_index)
+                    self._scan(tail_start)
+
+    def __str__(self):
+        return "DB: %s" % self.db_filename
+
+    def close(self):
+        if self._compaction:
+            self._compaction.join()
+        with self._lock:
+            self._close_files()
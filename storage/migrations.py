@@ -0,0 +1,206 @@
+"""Versioned schema migrations of the SQLite storage
+
+The migrations are applied in the order they are defined, the last
+applied version is kept in the schema_version table.
+New steps should always be appended at the end of the module.
+"""
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from collectors.urls import normalize_url
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = []
+
+
+def migration(step):
+    """Register a migration step"""
+    MIGRATIONS.append(step)
+    return step
+
+
+def column_names(connection, table):
+    return {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+
+
+def add_column(connection, table, name, definition):
+    """Add a column - tables created by create_all may have it already"""
+    if name not in column_names(connection, table):
+        connection.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def get_version(connection):
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"
+    )
+    return connection.execute("SELECT MAX(version) FROM schema_version").scalar() or 0
+
+
+def migrate(engine):
+    """Bring the DB schema to the latest version"""
+    with engine.begin() as connection:
+        current_version = get_version(connection)
+
+    for version, step in enumerate(MIGRATIONS, start=1):
+        if version <= current_version:
+            continue
+        logger.info(f"Migrating DB to version {version}: {step.__name__}")
+        with engine.begin() as connection:
+            step(connection)
+            connection.execute(
+                text("INSERT INTO schema_version (version) VALUES (:version)"),
+                version=version,
+            )
+
+
+# migrations ***
+
+
+@migration
+def add_hidden_column(connection):
+    add_column(connection, "items", "hidden", "BOOLEAN DEFAULT 0")
+
+
+@migration
+def add_items_indexes(connection):
+    """Listing and watermark queries filter by hidden/type sorting by timestamp"""
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_hidden_timestamp"
+        " ON items (hidden, timestamp DESC)"
+    )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_type_timestamp ON items (type, timestamp)"
+    )
+
+
+FULLTEXT_VALUES = """
+    {row}.rowid, {row}.title, {row}.url, {row}.type,
+    CASE WHEN json_valid({row}.extra)
+        THEN json_extract({row}.extra, '$.tags') END,
+    CASE WHEN json_valid({row}.extra)
+        THEN coalesce(
+            json_extract({row}.extra, '$.description'),
+            json_extract({row}.extra, '$.excerpt')
+        ) END
+"""
+
+
+@migration
+def add_items_fulltext(connection):
+    """Full-text index of the items, kept in sync by triggers
+
+    The index refers to the items rowid, it has to be filled again
+    with a VACUUM, that can renumber them
+    """
+    try:
+        connection.execute("SELECT json_valid('{}')")
+        connection.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts"
+            " USING fts5(title, url, type, tags, description)"
+        )
+    except OperationalError as e:
+        logger.warning(f"No full-text search, the search will use LIKE: {e}")
+        return
+    insert_new = (
+        "INSERT INTO items_fts (rowid, title, url, type, tags, description)"
+        f" VALUES ({FULLTEXT_VALUES.format(row='new')});"
+    )
+    delete_old = "DELETE FROM items_fts WHERE rowid = old.rowid;"
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items"
+        f" BEGIN {insert_new} END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items"
+        f" BEGIN {delete_old} END"
+    )
+    connection.execute(
+        f"CREATE TRIGGER IF NOT EXISTS items_fts_update"
+        f" AFTER UPDATE OF title, url, type, extra ON items"
+        f" BEGIN {delete_old} {insert_new} END"
+    )
+    connection.execute("DELETE FROM items_fts")
+    connection.execute(
+        "INSERT INTO items_fts (rowid, title, url, type, tags, description)"
+        f" SELECT {FULLTEXT_VALUES.format(row='items')} FROM items"
+    )
+
+
+@migration
+def add_thumb_subtype_columns(connection):
+    """Copy thumb and subtype from the extra json to their own columns"""
+    add_column(connection, "items", "thumb", "VARCHAR")
+    add_column(connection, "items", "subtype", "VARCHAR")
+    connection.execute(
+        "UPDATE items SET"
+        " thumb = json_extract(extra, '$.thumb'),"
+        " subtype = json_extract(extra, '$.subtype')"
+        " WHERE json_valid(extra)"
+    )
+
+
+@migration
+def add_normalized_url(connection):
+    """Index the normalized urls, to find the same link from different sources"""
+    add_column(connection, "items", "normalized_url", "VARCHAR")
+    rows = connection.execute("SELECT id, url FROM items").fetchall()
+    for item_id, url in rows:
+        connection.execute(
+            text("UPDATE items SET normalized_url = :normalized_url WHERE id = :id"),
+            normalized_url=normalize_url(url),
+            id=item_id,
+        )
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_normalized_url ON items (normalized_url)"
+    )
+
+
+@migration
+def add_content_hash(connection):
+    """The hash of the existing items is computed and stored on their first update"""
+    add_column(connection, "items", "content_hash", "VARCHAR")
+
+
+@migration
+def add_item_changes(connection):
+    """Log every change of the items, for the stages that process just what changed
+
+    The item_changes table comes from the model, the existing items
+    are logged as inserted
+    """
+    log_change = (
+        "INSERT INTO item_changes (item_id, type, operation)"
+        " VALUES ({row}.id, {row}.type, {operation});"
+    )
+    connection.execute(
+        "CREATE TRIGGER IF NOT EXISTS items_changes_insert AFTER INSERT ON items"
+        f" BEGIN {log_change.format(row='new', operation=repr('insert'))} END"
+    )
+    connection.execute(
+        "CREATE TRIGGER IF NOT EXISTS items_changes_delete AFTER DELETE ON items"
+        f" BEGIN {log_change.format(row='old', operation=repr('delete'))} END"
+    )
+    # the derived columns (thumb, normalized_url...) change with the ones they come from
+    hide_or_update = "CASE WHEN new.hidden THEN 'hide' ELSE 'update' END"
+    connection.execute(
+        "CREATE TRIGGER IF NOT EXISTS items_changes_update"
+        " AFTER UPDATE OF id, type, url, timestamp, title, extra, hidden ON items"
+        f" BEGIN {log_change.format(row='new', operation=hide_or_update)} END"
+    )
+    connection.execute(
+        "INSERT INTO item_changes (item_id, type, operation)"
+        " SELECT id, type, 'insert' FROM items ORDER BY timestamp"
+    )
+    add_column(connection, "sync_state", "change_seq", "INTEGER")
+
+
+@migration
+def add_missing_thumb_index(connection):
+    """The items still to enrich are few: a partial index finds them"""
+    connection.execute(
+        "CREATE INDEX IF NOT EXISTS ix_items_missing_thumb"
+        " ON items (hidden, timestamp DESC) WHERE thumb IS NULL"
+    )
@@ -1,5 +1,7 @@
 import datetime
+import itertools
 import logging
+import re
 
 import sqlalchemy
 from flask import json
@@ -11,19 +13,47 @@ from sqlalchemy import (
     func,
     Integer,
     Boolean,
+    Float,
     text,
+    event,
+    literal_column,
 )
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session, validates
+from sqlalchemy.pool import QueuePool
 
 from collectors.exceptions import DuplicateFound
-from storage import Storage
+from collectors.urls import normalize_url
+from storage import (
+    Storage,
+    INSERTED,
+    UPDATED,
+    UNCHANGED,
+    DUPLICATE,
+    DUPLICATE_URL,
+    content_hash,
+)
+from storage.migrations import migrate
 
 logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
+SQLITE_PRAGMAS = (
+    "journal_mode=WAL",  # readers don't wait for the collect writer
+    "synchronous=NORMAL",  # safe with WAL, sync only on checkpoints
+    "cache_size=-16000",  # 16MB of page cache per connection
+    "mmap_size=268435456",  # read up to 256MB via memory map
+)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
 
 class Item(Base):
     __tablename__ = "items"
@@ -35,6 +65,90 @@ class Item(Base):
     title = Column(String, nullable=False)
     extra = Column(String)
     hidden = Column(Boolean, nullable=False, default=False, server_default=text("0"))
+    # copied from extra, so they can be read without decoding it
+    thumb = Column(String)
+    subtype = Column(String)
+    # to find the same link coming from different sources
+    normalized_url = Column(String)
+    # of the collected content, None when it has to be computed again
+    content_hash = Column(String)
+
+    @validates("url")
+    def set_normalized_url(self, key, url):
+        self.normalized_url = normalize_url(url)
+        return url
+
+    def set_extra(self, extra):
+        """Set the extra json and the columns of the fields copied from it"""
+        self.extra = json.dumps(extra)
+        self.thumb = extra.get("thumb")
+        self.subtype = extra.get("subtype")
+
+
+# the columns of the items_fts full-text index
+FULLTEXT_COLUMNS = ("title", "url", "type", "tags", "description")
+
+
+def fulltext_match(search, columns=None):
+    """Convert a user search to a FTS5 query: all the words as prefixes
+    (optionally limited to some columns)"""
+    words = re.findall(r"\w+", search)
+    terms = [f'"{word}"*' for word in words]
+    if columns:
+        colspec = "{%s}" % " ".join(columns)
+        terms = [f"{colspec} : {term}" for term in terms]
+    return " ".join(terms)
+
+
+fulltext_binds = itertools.count()
+
+
+def fulltext_filter(query, search, columns=None):
+    """Filter an Item query with the full-text index, sorting by relevance"""
+    match = fulltext_match(search, columns)
+    if not match:
+        return query
+    # a bind name and an alias of its own, so more filters can be joined in a query
+    bind_name = f"fts_match_{next(fulltext_binds)}"
+    ranked = (
+        text(
+            "SELECT rowid, bm25(items_fts) AS score"
+            f" FROM items_fts WHERE items_fts MATCH :{bind_name}"
+        )
+        .bindparams(**{bind_name: match})
+        .columns(rowid=Integer, score=Float)
+        .alias()
+    )
+    query = query.join(ranked, ranked.c.rowid == literal_column("items.rowid"))
+    return query.order_by(ranked.c.score)
+
+
+class SyncState(Base):
+    """Where each collector stopped, to resume from there on the next run"""
+
+    __tablename__ = "sync_state"
+
+    key = Column(String, primary_key=True)
+    cursor = Column(String)  # the id of the newest item collected
+    etag = Column(String)
+    modified = Column(String)
+    last_timestamp = Column(DateTime)
+    last_run = Column(DateTime)
+    stats = Column(String)  # json of the last run stats
+    change_seq = Column(Integer)  # the last item change processed
+
+
+class ItemChange(Base):
+    """The log of the items changes, written by triggers on the items"""
+
+    __tablename__ = "item_changes"
+    __table_args__ = {"sqlite_autoincrement": True}  # never reuse a seq
+
+    seq = Column(Integer, primary_key=True)
+    item_id = Column(String, nullable=False)
+    type = Column(String)
+    operation = Column(String, nullable=False)  # insert, update, hide or delete
+    changed_at = Column(DateTime, server_default=func.current_timestamp())
 
 
 class User(Base):
@@ -65,75 +179,276 @@ class Subscription(Base):
 
 
 class StorageSqliteDB(Storage):
-    SQL_FIELDS = {"id", "type", "url", "timestamp", "title", "hidden"}
+    has_changelog = True
+    SQL_FIELDS = {
+        "id",
+        "type",
+        "url",
+        "timestamp",
+        "title",
+        "hidden",
+        "thumb",
+        "subtype",
+    }
+    # these are kept in the extra json too, they have a column for fast reads
+    EXTRA_COLUMNS = {"thumb", "subtype"}
 
     @staticmethod
-    def item_from_db(dbitem):
-        """Return an item dictionary out of the DB one"""
-        item = {k: getattr(dbitem, k) for k in StorageSqliteDB.SQL_FIELDS}
-        if dbitem.extra:
-            extra_fields = json.loads(dbitem.extra)
-            item.update(extra_fields)
+    def item_from_db(dbitem, fields=None):
+        """Return an item dictionary out of the DB one
+
+        When fields are given we get just them, and we decode the extra json
+        only when some are not in a column
+        """
+        if fields is None:
+            columns = StorageSqliteDB.SQL_FIELDS - StorageSqliteDB.EXTRA_COLUMNS
+        else:
+            columns = StorageSqliteDB.SQL_FIELDS & set(fields)
+        item = {k: getattr(dbitem, k) for k in columns}
+        if fields is None or not columns.issuperset(fields):
+            if dbitem.extra:
+                extra_fields = json.loads(dbitem.extra)
+                if fields is not None:
+                    extra_fields = {
+                        k: v for k, v in extra_fields.items() if k in fields
+                    }
+                item.update(extra_fields)
         return item
 
+    @staticmethod
+    def item_to_db(item):
+        """Return the DB Item out of an item dictionary
+        - all the non-SQL fields are moved in the extra json"""
+        fields = {
+            k: v
+            for k, v in item.items()
+            if k in StorageSqliteDB.SQL_FIELDS
+            and k not in StorageSqliteDB.EXTRA_COLUMNS
+        }
+        extra = {k: v for k, v in item.items() if k not in fields}
+        fields.setdefault("hidden", False)
+        dbitem = Item(**fields, content_hash=content_hash(item))
+        dbitem.set_extra(extra)
+        return dbitem
+
     def all(self):
-        items = []
-        for dbitem in (
-            self.db.query(Item)
-            .filter(Item.hidden.is_(False))
-            .order_by(sqlalchemy.desc(Item.timestamp))
-        ):
-            item = self.item_from_db(dbitem)
-            items.append(item)
-        return items
+        return list(self.iter_items())
 
-    def __init__(self, db_filename) -> None:
+    def iter_items(
+        self,
+        order="desc",
+        since=None,
+        types=None,
+        limit=None,
+        batch_size=500,
+        fields=None,
+    ):
+        if fields is None:
+            query = self.db.query(Item)
+        else:
+            # read only the needed columns
+            columns = {"extra"} if set(fields) - self.SQL_FIELDS else set()
+            columns |= self.SQL_FIELDS & set(fields)
+            query = self.db.query(*[getattr(Item, column) for column in columns])
+        query = query.filter(Item.hidden.is_(False))
+        if since is not None:
+            query = query.filter(Item.timestamp > since)
+        if types:
+            query = query.filter(Item.type.in_(types))
+        sort = sqlalchemy.desc if order == "desc" else sqlalchemy.asc
+        query = query.order_by(sort(Item.timestamp))
+        if limit:
+            query = query.limit(limit)
+        # stream the rows, without loading all of them in the session
+        for dbitem in query.yield_per(batch_size):
+            yield self.item_from_db(dbitem, fields)
+
+    def __init__(self, db_filename, dedupe_urls=True) -> None:
+        """When dedupe_urls, an item is not added when we have already
+        one with the same normalized url (coming from another source)"""
         super().__init__()
+        self.dedupe_urls = dedupe_urls
         engine = create_engine(
             f"sqlite:///{db_filename}",
+            # keep a pool of connections, shared by the API threads
+            poolclass=QueuePool,
+            pool_size=5,
+            max_overflow=10,
+            connect_args={"check_same_thread": False, "timeout": 15},
             # echo=True  # show the queries
         )
+        event.listen(engine, "connect", set_sqlite_pragmas)
         Base.metadata.create_all(engine)
-        self._ensure_hidden_column(engine)
+        migrate(engine)
+        self.engine = engine
+        # the search falls back to LIKE when SQLite doesn't have FTS5
+        self.has_fulltext = engine.has_table("items_fts")
         # noinspection PyPep8Naming
         Session = sessionmaker(bind=engine)
-        self.db = Session()
+        # every thread gets its own session, use remove() when done with it
+        self.db = scoped_session(Session)
 
     def search(self, id, type):
         pass
 
     def getitem(self, item_id):
         dbitem = self.db.query(Item).get(item_id)
-        return self.item_from_db(dbitem)
+        return self.item_from_db(dbitem) if dbitem else None
 
-    def upsert(self, item, update=False):
+    def upsert(self, item, update=False, update_hash=True):
         """Write to SQL Item - move all extra fields in an extra json"""
-        fields = {k: v for k, v in item.items() if k in self.SQL_FIELDS}
-        extra = {k: v for k, v in item.items() if k not in self.SQL_FIELDS}
-        fields.setdefault("hidden", False)
-        new = Item(**fields, extra=json.dumps(extra))
-        if update:
-            self.db.merge(new)
-        else:
-            self.db.add(new)
+        (status,) = self.upsert_many([item], update=update, update_hash=update_hash)
+        if status == DUPLICATE:
+            raise DuplicateFound(
+                f"We already have the id {item['id']} of type {item['type']} in the DB"
+            )
+        if status == DUPLICATE_URL:
+            raise DuplicateFound(f"We already have the url {item['url']} in the DB")
+        return status != UNCHANGED
+
+    def upsert_many(self, items, update=False, update_hash=True):
+        """Write a page of items with a single commit
+        - the updates that don't change the content hash are skipped,
+        the others are merged over the stored item"""
+        items = list(items)
+        ids = {item["id"] for item in items}
+        existing = {}  # the content hash of the items we have
+        if ids:
+            existing = dict(
+                self.db.query(Item.id, Item.content_hash).filter(Item.id.in_(ids))
+            )
+        known_urls = self.known_urls(
+            normalize_url(item.get("url"))
+            for item in items
+            if item["id"] not in existing
+        )
+        statuses = []
+        for item in items:
+            if item["id"] not in existing:
+                url_key = normalize_url(item.get("url"))
+                if known_urls.get(url_key, item["id"]) != item["id"]:
+                    logger.debug(
+                        f"Skipping {item['id']}: we have {item.get('url')}"
+                        f" as {known_urls[url_key]}"
+                    )
+                    statuses.append(DUPLICATE_URL)
+                    continue
+                dbitem = self.item_to_db(item)
+                self.db.add(dbitem)
+                existing[item["id"]] = dbitem.content_hash
+                if url_key and self.dedupe_urls:
+                    known_urls[url_key] = item["id"]
+                statuses.append(INSERTED)
+            elif update:
+                new_hash = content_hash(item)
+                if update_hash and existing[item["id"]] == new_hash:
+                    statuses.append(UNCHANGED)
+                    continue
+                stored = self.db.query(Item).get(item["id"])
+                stored_item = self.item_from_db(stored)
+                merged = {**stored_item, **item}
+                if update_hash:
+                    # the hash of what we collected, for the next time
+                    stored.content_hash = new_hash
+                    existing[item["id"]] = new_hash
+                if merged == stored_item:
+                    statuses.append(UNCHANGED)
+                    continue
+                dbitem = self.item_to_db(merged)
+                dbitem.content_hash = stored.content_hash
+                self.db.merge(dbitem)
+                statuses.append(UPDATED)
+            else:
+                statuses.append(DUPLICATE)
 
         try:
             self.db.commit()
-        except IntegrityError as e:
+        except IntegrityError:
             self.db.rollback()
-            if "unique" in str(e.orig).lower():
-                raise DuplicateFound(
-                    f"We already have the id {item['id']} of type {item['type']} in the DB"
-                )
-            else:
-                raise
+            raise
+        return statuses
+
+    def known_urls(self, url_keys):
+        """Return the id of the items we have with the given normalized urls"""
+        url_keys = {url_key for url_key in url_keys if url_key}
+        if not self.dedupe_urls or not url_keys:
+            return {}
+        return dict(
+            self.db.query(Item.normalized_url, Item.id).filter(
+                Item.normalized_url.in_(url_keys)
+            )
+        )
+
+    def items_needing_enrichment(self, limit=None):
+        # the thumb IS NULL condition uses the ix_items_missing_thumb partial index
+        query = (
+            self.db.query(Item)
+            .filter(Item.thumb.is_(None), Item.hidden.is_(False))
+            .order_by(sqlalchemy.desc(Item.timestamp))
+            .limit(limit)
+        )
+        return [self.item_from_db(dbitem) for dbitem in query]
+
+    def known_ids(self, type, ids=None):
+        query = self.db.query(Item.id).filter(Item.type == type)
+        if ids is not None:
+            ids = set(ids)
+            if not ids:
+                return set()
+            query = query.filter(Item.id.in_(ids))
+        return {item_id for item_id, in query}
 
     def max_timestamp(self, **kwargs):
         max_ts = self.db.query(func.max(Item.timestamp)).filter_by(**kwargs)
         return max_ts.one()[0]
 
+    def changes_since(self, seq=0, limit=None):
+        query = (
+            self.db.query(ItemChange)
+            .filter(ItemChange.seq > seq)
+            .order_by(ItemChange.seq)
+            .limit(limit)
+        )
+        return [
+            dict(
+                seq=change.seq,
+                id=change.item_id,
+                type=change.type,
+                operation=change.operation,
+                changed_at=change.changed_at,
+            )
+            for change in query
+        ]
+
+    def last_change_seq(self):
+        return self.db.query(func.max(ItemChange.seq)).scalar() or 0
+
     def close(self):
-        self.db.close()
+        self.db.remove()
+
+    def release_thread(self):
+        # the session of the calling thread goes back to the pool
+        self.db.remove()
+
+    def get_sync_state(self, key):
+        state = self.db.query(SyncState).get(key)
+        if state is None:
+            return {}
+        result = {
+            column.name: getattr(state, column.name)
+            for column in SyncState.__table__.columns
+        }
+        result["stats"] = json.loads(state.stats) if state.stats else {}
+        return result
+
+    def set_sync_state(self, key, **state):
+        sync_state = self.db.query(SyncState).get(key) or SyncState(key=key)
+        for name, value in state.items():
+            if name == "stats":
+                value = json.dumps(value)
+            setattr(sync_state, name, value)
+        self.db.add(sync_state)
+        self.db.commit()
 
     def active_subscriptions(self):
         return list(
@@ -142,14 +457,6 @@ class StorageSqliteDB(Storage):
             .order_by(sqlalchemy.asc(Subscription.subscription_date))
         )
 
-    @staticmethod
-    def _ensure_hidden_column(engine):
-        """Add the hidden column if it is missing (SQLite ALTER TABLE ADD COLUMN)."""
-        inspector = engine.execute("PRAGMA table_info(items)")
-        columns = [row[1] for row in inspector]
-        if "hidden" not in columns:
-            engine.execute("ALTER TABLE items ADD COLUMN hidden BOOLEAN DEFAULT 0")
-
     def set_last_notification(self, subscription):
         """Mark the time when the subscription got last notified"""
         q = self.db.query(Subscription).filter(
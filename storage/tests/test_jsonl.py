@@ -0,0 +1,70 @@
+import threading
+
+from storage.jsonl import StorageJSONL
+from storage.tests.util import make_item
+
+
+def test_reopen_after_updates(tmpdir):
+    filename = str(tmpdir.join("db.jsonl"))
+    db = StorageJSONL(filename)
+    db.upsert_many([make_item(1), make_item(2)])
+    db.upsert_many([make_item(1, title="Updated")], update=True)
+    db.upsert_many([make_item(2, hidden=True)], update=True)
+    db.set_sync_state("rss", cursor="1")
+    db.close()
+
+    db = StorageJSONL(filename)
+    assert [item["title"] for item in db.iter_items()] == ["Updated"]
+    assert db.search(id="1", type="RSS")[0]["timestamp"] == make_item(1)["timestamp"]
+    assert db.known_ids("RSS") == {"1", "2"}
+    assert db.get_sync_state("rss") == {"cursor": "1"}
+    db.close()
+
+
+def test_truncated_last_line(tmpdir):
+    filename = str(tmpdir.join("db.jsonl"))
+    db = StorageJSONL(filename)
+    db.upsert_many([make_item(1)])
+    db.close()
+    with open(filename, "ab") as f:
+        f.write(b'{"id": "2", "type": "RSS", "tit')  # a write interrupted
+
+    db = StorageJSONL(filename)
+    assert db.known_ids("RSS") == {"1"}
+    db.upsert_many([make_item(2)])
+    db.close()
+
+    db = StorageJSONL(filename)
+    assert [item["id"] for item in db.iter_items()] == ["2", "1"]
+    db.close()
+
+
+def test_compact_while_appending(tmpdir):
+    filename = str(tmpdir.join("db.jsonl"))
+    db = StorageJSONL(filename)
+    db.compact_min_records = 10**9  # we compact explicitly
+    db.upsert_many([make_item(i) for i in range(100)])
+    for version in range(5):
+        db.upsert_many(
+            [make_item(i, title=f"Version {version}") for i in range(100)],
+            update=True,
+        )
+
+    def append():
+        for i in range(100, 200):
+            db.upsert_many([make_item(i)])
+            db.upsert_many([make_item(i - 100, title="Last")], update=True)
+
+    writer = threading.Thread(target=append)
+    writer.start()
+    db.compact()
+    writer.join()
+
+    expected = {str(i): "Last" for i in range(100)}
+    expected.update({str(i): f"Item {i}" for i in range(100, 200)})
+    assert {item["id"]: item["title"] for item in db.iter_items()} == expected
+    db.close()
+
+    db = StorageJSONL(filename)
+    assert {item["id"]: item["title"] for item in db.iter_items()} == expected
+    db.close()
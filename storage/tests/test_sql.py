@@ -0,0 +1,116 @@
+import sqlite3
+
+from storage import Storage, INSERTED, UPDATED, UNCHANGED, DUPLICATE, DUPLICATE_URL
+from storage.migrations import MIGRATIONS
+from storage.tests.util import make_item
+
+
+def test_upsert_many_statuses(tmpdir):
+    db = Storage.get("sqlite", str(tmpdir.join("db.sqlite")))
+    # the same id twice in a batch
+    assert db.upsert_many([make_item(1), make_item(1, title="Again")]) == [
+        INSERTED,
+        DUPLICATE,
+    ]
+    assert db.upsert_many(
+        [make_item(2), make_item(2, title="Changed"), make_item(1, title="Again")],
+        update=True,
+    ) == [INSERTED, UPDATED, UPDATED]
+    assert db.getitem("1")["title"] == "Again"
+    assert db.getitem("2")["title"] == "Changed"
+    db.close()
+
+
+def create_legacy_db(filename):
+    """A DB as created before the migrations"""
+    connection = sqlite3.connect(filename)
+    connection.execute(
+        "CREATE TABLE items (id VARCHAR PRIMARY KEY, type VARCHAR NOT NULL,"
+        " url VARCHAR, timestamp DATETIME NOT NULL, title VARCHAR NOT NULL,"
+        " extra VARCHAR)"
+    )
+    connection.execute(
+        "INSERT INTO items VALUES ('1', 'RSS', 'http://www.example.com/1/',"
+        " '2020-01-01 00:01:00.000000', 'Item 1', '{\"thumb\": \"t.png\"}')"
+    )
+    connection.commit()
+    connection.close()
+
+
+def test_migrate_legacy_db(tmpdir):
+    filename = str(tmpdir.join("db.sqlite"))
+    create_legacy_db(filename)
+
+    db = Storage.get("sqlite", filename)
+    version = db.db.execute("SELECT MAX(version) FROM schema_version").scalar()
+    assert version == len(MIGRATIONS)
+    assert db.getitem("1")["hidden"] is False
+    db.close()
+
+    # migrating again does nothing
+    db = Storage.get("sqlite", filename)
+    versions = db.db.execute("SELECT COUNT(*) FROM schema_version").scalar()
+    assert versions == len(MIGRATIONS)
+    db.close()
+
+
+def test_duplicate_urls(tmpdir):
+    filename = str(tmpdir.join("db.sqlite"))
+    create_legacy_db(filename)
+    db = Storage.get("sqlite", filename)
+    # the legacy urls are indexed normalized too
+    assert db.upsert_many([make_item(2, url="https://example.com/1")]) == [
+        DUPLICATE_URL
+    ]
+    # the same url from another source, in the same batch
+    assert db.upsert_many(
+        [make_item(3), make_item(4, url="https://www.example.com/3/")]
+    ) == [INSERTED, DUPLICATE_URL]
+    assert db.known_ids("RSS") == {"1", "3"}
+    db.close()
+
+
+def test_unchanged_legacy_item_gets_its_hash(tmpdir):
+    filename = str(tmpdir.join("db.sqlite"))
+    create_legacy_db(filename)
+    db = Storage.get("sqlite", filename)
+    legacy = make_item(1, url="http://www.example.com/1/", thumb="t.png")
+    assert db.upsert_many([legacy], update=True) == [UNCHANGED]
+    assert db.db.execute("SELECT content_hash FROM items").scalar()
+    assert db.upsert_many([legacy], update=True) == [UNCHANGED]
+    db.close()
+
+
+def test_enriched_item_unchanged_on_resync(tmpdir):
+    db = Storage.get("sqlite", str(tmpdir.join("db.sqlite")))
+    db.upsert_many([make_item(1, tags=["a"])])
+    enriched = dict(db.getitem("1"), thumb="t.png", title="Better title")
+    assert db.upsert_many([enriched], update=True, update_hash=False) == [UPDATED]
+
+    # the collector gets the same again: what it doesn't have stays
+    assert db.upsert_many([make_item(1, tags=["a"])], update=True) == [UNCHANGED]
+    assert db.upsert_many([make_item(1, tags=["b"])], update=True) == [UPDATED]
+    item = db.getitem("1")
+    assert (item["thumb"], item["title"], item["tags"]) == ("t.png", "Item 1", ["b"])
+    assert db.items_needing_enrichment() == []
+    db.close()
+
+
+def test_changes_since(tmpdir):
+    filename = str(tmpdir.join("db.sqlite"))
+    create_legacy_db(filename)
+    db = Storage.get("sqlite", filename)
+    # the existing items are logged as inserted
+    assert [change["id"] for change in db.changes_since()] == ["1"]
+    seq = db.last_change_seq()
+    db.upsert_many([make_item(2)])
+    db.upsert_many([make_item(2, title="Changed")], update=True)
+    db.upsert(dict(db.getitem("1"), hidden=True), update=True)
+    changes = db.changes_since(seq)
+    assert [(change["id"], change["operation"]) for change in changes] == [
+        ("2", "insert"),
+        ("2", "update"),
+        ("1", "hide"),
+    ]
+    assert db.changes_since(changes[0]["seq"], limit=1) == [changes[1]]
+    db.close()
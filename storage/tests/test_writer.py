@@ -0,0 +1,27 @@
+import threading
+
+from storage import SerializedStorage
+
+
+class ThreadsStorage:
+    """Record the threads calling it"""
+
+    def __init__(self):
+        self.calls = []
+
+    def known_ids(self, type, ids=None):
+        self.calls.append(("known_ids", threading.current_thread().name))
+        return set()
+
+    def release_thread(self):
+        self.calls.append(("release_thread", threading.current_thread().name))
+
+
+def test_calls_and_release_in_the_writer_thread():
+    storage = ThreadsStorage()
+    db = SerializedStorage(storage)
+    db.known_ids("RSS")
+    db.close()
+    assert [call for call, _ in storage.calls] == ["known_ids", "release_thread"]
+    assert len({thread for _, thread in storage.calls}) == 1
+    assert storage.calls[0][1] != threading.current_thread().name
@@ -0,0 +1,16 @@
+import datetime
+
+NOW = datetime.datetime(2020, 1, 1)
+
+
+def make_item(i, **fields):
+    """An RSS item, the newer the higher is i"""
+    item = dict(
+        id=str(i),
+        type="RSS",
+        url=f"http://example.com/{i}",
+        timestamp=NOW + datetime.timedelta(minutes=i),
+        title=f"Item {i}",
+    )
+    item.update(fields)
+    return item
@@ -0,0 +1,36 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SerializedStorage:
+    """Wrap a storage so that the calls of many threads run in a single one
+
+    The collectors running concurrently share it: the DB sees a single
+    writer, and the backends that aren't thread safe are fine.
+    The generators (like iter_items) are consumed by the caller thread.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="storage-writer"
+        )
+
+    def __getattr__(self, name):
+        attribute = getattr(self.storage, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def serialized(*args, **kwargs):
+            return self._executor.submit(attribute, *args, **kwargs).result()
+
+        return serialized
+
+    def __str__(self):
+        return str(self.storage)
+
+    def close(self):
+        """Stop the writer thread - the wrapped storage stays open"""
+        self._executor.submit(self.storage.release_thread).result()
+        self._executor.shutdown()
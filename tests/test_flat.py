@@ -0,0 +1,76 @@
+import threading
+import time
+
+import flat
+from collectors.generic import Collector
+from storage.tests.util import make_item
+
+
+class OkCollector(Collector):
+    type = "RSS"
+
+    def run(self, **params):
+        self.save_items([make_item(2), make_item(1)])
+
+
+class FailingCollector(Collector):
+    type = "Failing"
+
+    def run(self, **params):
+        raise ValueError("Broken API")
+
+
+class SlowCollector(Collector):
+    type = "Slow"
+
+    def run(self, **params):
+        for page in range(10):
+            time.sleep(0.1)
+            self.save_items([make_item(page, type=self.type)])
+
+
+stuck = threading.Event()
+
+
+class StuckCollector(Collector):
+    type = "Stuck"
+
+    def run(self, **params):
+        stuck.wait(10)  # a request that never answers
+
+
+def make_aggregator(tmpdir, monkeypatch, collectors):
+    config = dict(
+        db=str(tmpdir.join("db.sqlite")), format="sqlite", collect_timeout=0.25
+    )
+    monkeypatch.setattr(flat.Aggregator, "load_config", staticmethod(lambda: config))
+    monkeypatch.setattr(flat.Aggregator, "collectors", collectors)
+    monkeypatch.setattr(flat, "fill_missing_infos", lambda db: None)
+    return flat.Aggregator()
+
+
+def test_collect_outcomes(tmpdir, monkeypatch):
+    aggregator = make_aggregator(
+        tmpdir, monkeypatch, [OkCollector, FailingCollector, SlowCollector]
+    )
+    results = aggregator.collect()
+    assert [(result["name"], result["outcome"]) for result in results] == [
+        ("RSS", "ok"),
+        ("Failing", "failed"),
+        ("Slow", "timeout"),
+    ]
+    assert results[0]["stats"]["added"] == 2
+    db = aggregator.db
+    # only the completed runs move their sync state
+    assert db.get_sync_state("RSS")["cursor"] == "2"
+    assert db.get_sync_state("Failing") == {}
+    assert db.get_sync_state("Slow") == {}
+
+
+def test_stuck_collector_is_left_behind(tmpdir, monkeypatch):
+    aggregator = make_aggregator(tmpdir, monkeypatch, [StuckCollector, OkCollector])
+    start = time.monotonic()
+    results = aggregator.collect()
+    stuck.set()
+    assert time.monotonic() - start < 2
+    assert [result["outcome"] for result in results] == ["timeout", "ok"]